@@ -1,7 +1,9 @@
-import json
-from typing import Callable
 import os
+import re
 import ssl
+import threading
+import time
+from datetime import datetime
 import certifi
 import requests
 from slack_sdk.web import WebClient
@@ -16,17 +18,33 @@ from newsletter import (
     parse_rss,
     parse_youtube,
     util,
-    parse_pdf,
+    metrics,
+    usage,
+    pipeline,
+    digest,
+    rank,
+    jobs,
 )
-from newsletter.slack import EditableMessage
+from newsletter.slack import EditableMessage, RecordedMessage
 
 app = App(
     client=WebClient(
         token=os.environ.get("SLACK_BOT_TOKEN"),
+        base_url=os.environ.get("SLACK_API_URL", WebClient.BASE_URL),
         ssl=ssl.create_default_context(cafile=certifi.where()),
     ),
 )
 
+job_queue = jobs.JobQueue(
+    num_workers=int(os.environ.get("NEWSY_WORKERS", 4)),
+    max_per_channel=int(os.environ.get("NEWSY_MAX_JOBS_PER_CHANNEL", 2)),
+)
+
+NEWS_HEADER = "Here's the latest news from today for you!"
+
+# only one news digest is built at a time, see _precompute_news
+_news_build_lock = threading.Lock()
+
 ARTICLE_FILTER = """Articles related to Artificial intelligence (AI), Machine Learning (ML), foundation models, LLMs (large language models), GPT, generation models.
 """
 
@@ -36,6 +54,29 @@ PAPER_FILTER = """Papers related to:
 3. Techniques for optimizing size or efficiency of language models (like quantization or sparsification)
 """
 
+# max number of concurrent `lm.matches_filter` calls while building a digest
+LLM_CONCURRENCY = int(os.environ.get("NEWSY_LLM_CONCURRENCY", 8))
+# number of abstracts classified per `lm.matches_filter_batch` call
+PAPER_BATCH_SIZE = int(os.environ.get("NEWSY_PAPER_BATCH_SIZE", 10))
+# max number of pdf sections read concurrently when answering a question about a paper
+SECTION_CONCURRENCY = int(os.environ.get("NEWSY_SECTION_CONCURRENCY", 6))
+# seconds until the HackerNews posts that aren't fetched yet are given up on. "" waits for all
+_hn_deadline = os.environ.get("NEWSY_HN_DEADLINE", "120")
+HN_DEADLINE = float(_hn_deadline) if _hn_deadline != "" else None
+# only the PRERANK_TOP_K best matching papers by a local relevance score (plus any scoring
+# at least PRERANK_MIN_SCORE) are sent to the LLM. Set both to "" to check every paper.
+_prerank_top_k = os.environ.get("NEWSY_PRERANK_TOP_K", "40")
+PRERANK_TOP_K = int(_prerank_top_k) if _prerank_top_k != "" else None
+_prerank_min_score = os.environ.get("NEWSY_PRERANK_MIN_SCORE", "")
+PRERANK_MIN_SCORE = float(_prerank_min_score) if _prerank_min_score != "" else None
+
+# slack user ids allowed to use admin commands like `stats`, comma separated
+ADMIN_USERS = set(
+    user.strip()
+    for user in os.environ.get("NEWSY_ADMIN_USERS", "").split(",")
+    if user.strip() != ""
+)
+
 HELP = """Valid commands are:
 *`news`*
 > Pulls from a list of news sources related to AI/ML.
@@ -62,6 +103,36 @@ HELP = """Valid commands are:
 @app.event("message")
 @app.event("app_mention")
 def handle_app_mention(event):
+    # message_changed events happen when slack adds the preview for urls
+    # app_mention's also get an identical message event, but we filter them out by checking for channel_type != im
+    if event["type"] == "message" and (
+        event["channel_type"] != "im" or event.get("subtype", "") == "message_changed"
+    ):
+        return
+
+    # the listener returns right away so slack gets its ack in time. The actual work
+    # happens on the job queue, which also drops events that slack redelivers.
+    job_queue.submit(
+        lambda: _handle_event(event),
+        priority=_job_priority(event),
+        channel=event["channel"],
+        key=event.get("client_msg_id", event["event_ts"]),
+    )
+
+
+def _job_priority(event):
+    """
+    Quick commands (summaries & questions) go ahead of crawls, and `news` goes last.
+    """
+    command = re.sub(r"<@\w+>", "", event.get("text", "")).strip().lower()
+    if command == "news":
+        return 2
+    if command.startswith(("arxiv", "reddit", "hackernews")):
+        return 1
+    return 0
+
+
+def _handle_event(event):
     def printl(msg):
         app.client.chat_postMessage(
             text=msg,
@@ -71,13 +142,6 @@ def handle_app_mention(event):
             unfurl_media=False,
         )
 
-    # message_changed events happen when slack adds the preview for urls
-    # app_mention's also get an identical message event, but we filter them out by checking for channel_type != im
-    if event["type"] == "message" and (
-        event["channel_type"] != "im" or event.get("subtype", "") == "message_changed"
-    ):
-        return
-
     assert len(event["blocks"]) == 1
     assert event["blocks"][0]["type"] == "rich_text"
     assert len(event["blocks"][0]["elements"]) == 1
@@ -88,109 +152,118 @@ def handle_app_mention(event):
     if event["type"] == "app_mention":
         parts = [p for p in parts if p["type"] != "user"]
 
-    print("Starting", event["text"])
-
     try:
-        if parts[0]["type"] == "link":
-            _do_summarize(
-                parts[0]["url"],
-                EditableMessage(
-                    app.client,
-                    event["channel"],
-                    "_Working on it..._",
-                    ts=event["event_ts"],
-                ),
-                printl,
-            )
-            print("Finished", event["text"])
-            return
-
-        if parts[0]["type"] != "text":
-            printl(f"Unrecognized command `{parts[0]}`. " + HELP)
-            print("Finished", event["text"])
-            return
-
-        command = parts[0]["text"].strip()
-
-        if command == "news":
-            _do_news(channel=event["channel"])
-        elif (
-            "summarize" in command or "summary" in command or "explain" in command
-        ) and any(p["type"] == "link" for p in parts):
-            if len(parts) != 2 or parts[1]["type"] != "link":
-                printl("Missing a link to summarize. " + HELP)
-                print("Finished", event["text"])
-                return
-            _do_summarize(
-                parts[1]["url"],
-                EditableMessage(
-                    app.client,
-                    event["channel"],
-                    "_Working on it..._",
-                    ts=event["event_ts"],
-                ),
-                printl,
-            )
-        elif command.startswith("arxiv"):
-            assert len(parts) == 1
-            parts = command.split(" ")
-            if len(parts) < 4:
-                printl("Must include a arxiv category and description. " + HELP)
-                print("Finished", event["text"])
-                return
-            category = parts[1]
-            sub_category = parts[2]
-            description = " ".join(parts[3:])
-            _arxiv_search(category, sub_category, description, channel=event["channel"])
-        elif command.startswith("reddit"):
-            assert len(parts) == 1
-            parts = command.split(" ")
-            if len(parts) < 3:
-                printl("Must include a subreddit name and description. " + HELP)
-                print("Finished", event["text"])
+        with metrics.command(_command_name(parts)):
+            if parts[0]["type"] == "link":
+                _do_summarize(
+                    parts[0]["url"],
+                    EditableMessage(
+                        app.client,
+                        event["channel"],
+                        "_Working on it..._",
+                        ts=event["event_ts"],
+                    ),
+                )
                 return
-            subreddit_name = parts[1]
-            description = " ".join(parts[2:])
-            _reddit_search(subreddit_name, description, channel=event["channel"])
-        elif command.startswith("hackernews"):
-            assert len(parts) == 1
-            parts = command.split(" ")
-            if len(parts) < 2:
-                printl("Must include a description. " + HELP)
-                print("Finished", event["text"])
+
+            if parts[0]["type"] != "text":
+                printl(f"Unrecognized command `{parts[0]}`. " + HELP)
                 return
-            description = " ".join(parts[1:])
-            _hackernews_search(description, channel=event["channel"])
-        else:
-            if "thread_ts" in event:
-                ts = event["thread_ts"]
+
+            command = parts[0]["text"].strip()
+
+            if command == "news":
+                _do_news(channel=event["channel"])
+            elif command == "stats":
+                _do_stats(event["user"], printl)
+            elif (
+                "summarize" in command or "summary" in command or "explain" in command
+            ) and any(p["type"] == "link" for p in parts):
+                if len(parts) != 2 or parts[1]["type"] != "link":
+                    printl("Missing a link to summarize. " + HELP)
+                    return
+                _do_summarize(
+                    parts[1]["url"],
+                    EditableMessage(
+                        app.client,
+                        event["channel"],
+                        "_Working on it..._",
+                        ts=event["event_ts"],
+                    ),
+                )
+            elif command.startswith("arxiv"):
+                assert len(parts) == 1
+                parts = command.split(" ")
+                if len(parts) < 4:
+                    printl("Must include a arxiv category and description. " + HELP)
+                    return
+                category = parts[1]
+                sub_category = parts[2]
+                description = " ".join(parts[3:])
+                _arxiv_search(
+                    category, sub_category, description, channel=event["channel"]
+                )
+            elif command.startswith("reddit"):
+                assert len(parts) == 1
+                parts = command.split(" ")
+                if len(parts) < 3:
+                    printl("Must include a subreddit name and description. " + HELP)
+                    return
+                subreddit_name = parts[1]
+                description = " ".join(parts[2:])
+                _reddit_search(subreddit_name, description, channel=event["channel"])
+            elif command.startswith("hackernews"):
+                assert len(parts) == 1
+                parts = command.split(" ")
+                if len(parts) < 2:
+                    printl("Must include a description. " + HELP)
+                    return
+                description = " ".join(parts[1:])
+                _hackernews_search(description, channel=event["channel"])
             else:
-                ts = event["event_ts"]
-            # this is probably a question in a summary thread
-            conversation = app.client.conversations_replies(
-                channel=event["channel"], ts=ts
-            )
-            _do_interactive(
-                conversation["messages"],
-                EditableMessage(
-                    app.client,
-                    event["channel"],
-                    "_Let me check..._",
-                    ts=ts,
-                ),
-            )
+                if "thread_ts" in event:
+                    ts = event["thread_ts"]
+                else:
+                    ts = event["event_ts"]
+                # this is probably a question in a summary thread
+                conversation = app.client.conversations_replies(
+                    channel=event["channel"], ts=ts
+                )
+                _do_interactive(
+                    conversation["messages"],
+                    EditableMessage(
+                        app.client,
+                        event["channel"],
+                        "_Let me check..._",
+                        ts=ts,
+                    ),
+                )
     except Exception as err:
         printl(f"Sorry I encountered an error: {type(err)} {repr(err)}")
 
-    print("Finished", event["text"])
 
+def _command_name(parts):
+    """
+    The name of the command in `parts` (mirrors the dispatch in `_handle_event`), for metrics.
+    """
+    if parts[0]["type"] == "link":
+        return "summarize"
+    if parts[0]["type"] != "text":
+        return "unknown"
+    command = parts[0]["text"].strip()
+    if command in ("news", "stats"):
+        return command
+    if ("summarize" in command or "summary" in command or "explain" in command) and any(
+        p["type"] == "link" for p in parts
+    ):
+        return "summarize"
+    for name in ("arxiv", "reddit", "hackernews"):
+        if command.startswith(name):
+            return name
+    return "interactive"
 
-def _do_summarize(
-    url,
-    slack_msg: EditableMessage,
-    printl: Callable[[str], None],
-    model="gpt-3.5-turbo-16k",
-):
+
+def _do_summarize(url, slack_msg: EditableMessage, model="gpt-3.5-turbo-16k"):
     sections = []
 
     content = (
@@ -215,7 +288,13 @@ def _do_summarize(
             )
 
             slack_msg.edit_line(f"_Summarizing content..._")
-            summary = lm.summarize_post(item["title"], item["content"])
+            summary = lm.summarize_post(
+                item["title"],
+                item["content"],
+                on_partial=slack_msg.stream_line(
+                    f"*<{item['content_url']}|{item['title']}>* discusses:\n"
+                ),
+            )
 
             lines = [
                 f"*<{item['content_url']}|{item['title']}>* discusses:",
@@ -228,7 +307,8 @@ def _do_summarize(
             else:
                 lines[-1] += " centered around:"
                 for i, c in enumerate(item["comments"]):
-                    slack_msg.edit_line(f"_Summarizing comment {i + 1}..._")
+                    # a progress message, so the streamed summary stays visible
+                    slack_msg.set_progress_msg(f"Summarizing comment {i + 1}...")
                     comment_summary = lm.summarize_comment(
                         item["title"], summary, c["content"]
                     )
@@ -247,7 +327,13 @@ def _do_summarize(
                 f"[begin Article]\n{item['title']}\n\n{item['abstract']}\n[end Article]"
             )
             slack_msg.edit_line(f"_Summarizing abstract..._")
-            summary = lm.summarize_abstract(item["title"], item["abstract"])
+            summary = lm.summarize_abstract(
+                item["title"],
+                item["abstract"],
+                on_partial=slack_msg.stream_line(
+                    f"The abstract for *<{url}|{item['title']}>* discusses:\n"
+                ),
+            )
             sections.append(
                 f"The abstract for *<{url}|{item['title']}>* discusses:\n{summary}"
             )
@@ -258,7 +344,13 @@ def _do_summarize(
                 f"[begin Article]\n{item['title']}\n\n{item['content']}\n[end Article]"
             )
             slack_msg.edit_line(f"_Summarizing video..._")
-            summary = lm.summarize_post(item["title"], item["content"])
+            summary = lm.summarize_post(
+                item["title"],
+                item["content"],
+                on_partial=slack_msg.stream_line(
+                    f"*<{url}|{item['title']}>* discusses:\n"
+                ),
+            )
             sections.append(f"*<{url}|{item['title']}>* discusses:\n{summary}")
         else:
             # generic web page
@@ -268,7 +360,13 @@ def _do_summarize(
                 f"[begin Article]\n{item['title']}\n\n{item['text']}\n[end Article]"
             )
             slack_msg.edit_line(f"_Summarizing content..._")
-            summary = lm.summarize_post(item["title"], item["text"])
+            summary = lm.summarize_post(
+                item["title"],
+                item["text"],
+                on_partial=slack_msg.stream_line(
+                    f"*<{url}|{item['title']}>* discusses:\n"
+                ),
+            )
             sections.append(f"*<{url}|{item['title']}>* discusses:\n{summary}")
     except requests.exceptions.HTTPError as err:
         sections.append(
@@ -276,6 +374,10 @@ def _do_summarize(
         )
     except util.ScrapePreventedError as err:
         sections.append(f"This website prevented me accessing its content, sorry!")
+    except util.UnsupportedContentError as err:
+        sections.append(
+            f"This link points to `{err.content_type}` content ({err.reason}), which I can't read, sorry!"
+        )
     except requests.exceptions.ReadTimeout as err:
         sections.append(f"My request to {err.request.url} timed out, sorry!")
     except Exception as err:
@@ -283,10 +385,10 @@ def _do_summarize(
 
     discussions = []
     if not is_hn_comments:
-        slack_msg.edit_line("_Searching for hackernews posts..._")
+        slack_msg.set_progress_msg("Searching for hackernews posts...")
         discussions.append(("HackerNews", parse_hn.search_for_url(url)))
     if not is_reddit_comments:
-        slack_msg.edit_line("_Searching for reddit posts..._")
+        slack_msg.set_progress_msg("Searching for reddit posts...")
         discussions.append(("reddit", parse_reddit.search_for_url(url)))
 
     for name, discussion in discussions:
@@ -301,7 +403,7 @@ def _do_summarize(
         else:
             lines[0] += " centered around:"
             for i, c in enumerate(discussion["comments"]):
-                slack_msg.edit_line(f"_Summarizing comment {i + 1} on {name}..._")
+                slack_msg.set_progress_msg(f"Summarizing comment {i + 1} on {name}...")
                 if summary is not None:
                     comment_summary = lm.summarize_comment(
                         discussion["title"], summary, c["content"]
@@ -322,41 +424,128 @@ def _do_summarize(
 
     msg = "\n\n".join(sections)
     slack_msg.edit_line(msg)
+    slack_msg.flush()
 
     if summary is None:
         return
 
-    from langchain.chat_models import ChatOpenAI
     from langchain.schema import HumanMessage, AIMessage, SystemMessage
 
-    chat = ChatOpenAI(model=model, request_timeout=30)
+    header = "Here are some follow up questions to help you dive deeper into this post (tag me and and I can answer them!):\n"
+    questions = slack_msg.editable_reply("_Thinking of follow up questions..._")
+    try:
+        response = lm.chat(
+            [
+                SystemMessage(content=content),
+                AIMessage(content=summary),
+                HumanMessage(
+                    content="Suggest 5 follow up questions to learn more about this post. The questions should be answerable based on the content in the article."
+                ),
+            ],
+            kind="follow_up_questions",
+            model=model,
+            on_partial=questions.stream_line(header),
+        )
+        questions.edit_line(header + response)
+    except Exception as err:
+        questions.edit_line(
+            f"Sorry I couldn't come up with follow up questions: {type(err)} {repr(err)}"
+        )
+    questions.flush()
 
-    response = chat(
-        [
-            SystemMessage(content=content),
-            AIMessage(content=summary),
-            HumanMessage(
-                content="Suggest 5 follow up questions to learn more about this post. The questions should be answerable based on the content in the article."
-            ),
-        ]
+
+def _do_stats(user, printl):
+    if user not in ADMIN_USERS:
+        printl("Sorry, `stats` is only available to admins.")
+        return
+
+    since, rows = usage.summary()
+    if len(rows) == 0:
+        printl("No LLM calls recorded yet.")
+        return
+
+    def seconds(value):
+        return "-" if value is None else f"{value:.2f}"
+
+    lines = [
+        f"{'prompt':<22} {'model':<18} {'calls':>6} {'cached':>6} {'esc':>4} {'err':>4} {'prompt tok':>11} {'compl tok':>10} {'cost $':>8} {'p50 s':>6} {'p95 s':>6}"
+    ]
+    for row in rows:
+        lines.append(
+            f"{row['kind']:<22} {row['model']:<18} {row['calls']:>6} {row['cache_hits']:>6} {row['escalations']:>4} {row['errors']:>4} {row['prompt_tokens']:>11} {row['completion_tokens']:>10} {row['cost']:>8.2f} {seconds(row['p50']):>6} {seconds(row['p95']):>6}"
+        )
+    lines.append(
+        f"{'total':<22} {'':<18} {sum(r['calls'] for r in rows):>6} {sum(r['cache_hits'] for r in rows):>6} {sum(r['escalations'] for r in rows):>4} {sum(r['errors'] for r in rows):>4} {sum(r['prompt_tokens'] for r in rows):>11} {sum(r['completion_tokens'] for r in rows):>10} {sum(r['cost'] for r in rows):>8.2f}"
     )
+    table = "\n".join(lines)
     printl(
-        "Here are some follow up questions to help you dive deeper into this post (tag me and and I can answer them!):\n"
-        + response.content
+        f"*LLM usage since {datetime.utcfromtimestamp(since):%Y-%m-%d %H:%M} UTC:*\n```\n{table}\n```"
     )
 
 
 def _do_news(channel):
-    news = EditableMessage(
-        app.client, channel, "Here's the latest news from today for you!"
+    cached = digest.load("news")
+    news = EditableMessage(app.client, channel, NEWS_HEADER)
+    if cached is None:
+        _compile_news(news)
+        digest.save("news", news.sections())
+        news.flush()
+        return
+
+    # post the precomputed digest right away, then fill in anything new since it was built
+    sections, stored_at = cached
+    news.replace(sections)
+    if time.time() - stored_at < digest.DIGEST_REFRESH_AGE:
+        news.flush()
+        return
+    news.set_progress_msg(
+        f"Checking for anything new since {datetime.utcfromtimestamp(stored_at):%H:%M} UTC"
     )
+    news.flush()
+    job_queue.submit(
+        lambda: _refresh_news(news, stored_at), priority=2, channel=channel
+    )
+
 
+def _refresh_news(news: EditableMessage, stored_at):
+    """
+    Rebuilds the digest that `news` was posted from, and updates `news` with the result.
+    """
+    try:
+        with metrics.command("digest"):
+            news.replace(_precompute_news(stored_after=stored_at))
+    except Exception as err:
+        print(f"Error while refreshing the news digest: {type(err)} {repr(err)}")
+        news.set_progress_msg("Couldn't check for anything new, sorry!")
+    news.flush()
+
+
+def _precompute_news(stored_after=None):
+    """
+    Builds the news digest without posting it, and stores it for `_do_news` to use.
+    """
+    with _news_build_lock:
+        if stored_after is not None:
+            # someone else may have built a newer one while we waited for the lock
+            cached = digest.load("news")
+            if cached is not None and cached[1] > stored_after:
+                return cached[0]
+        news = RecordedMessage(NEWS_HEADER)
+        _compile_news(news)
+        sections = news.sections()
+        digest.save("news", sections)
+        return sections
+
+
+def _compile_news(news: EditableMessage):
     news.start_new_section()
     news.add_line("*HackerNews:*")
     news.set_progress_msg("Retrieving posts")
     num = 0
     total = 0
-    for post in parse_hn.iter_top_posts(num_posts=25):
+    for post, verdict in _filter_posts(
+        parse_hn.iter_top_posts(num_posts=25, timeout=HN_DEADLINE), ARTICLE_FILTER
+    ):
         if "error" in post:
             print(
                 f"Error while processing {post['comments_url']}: {type(post['error'])} {repr(post['error'])}"
@@ -365,9 +554,7 @@ def _do_news(channel):
         news.set_progress_msg(f"Processing <{post['content_url']}|{post['title']}>")
         total += 1
         try:
-            should_show = lm.matches_filter(
-                post["title"] + "\n\n" + post["content"], ARTICLE_FILTER
-            )
+            should_show = verdict.result()
         except Exception as err:
             print(
                 f"Error while processing {post['comments_url']}: {type(err)} {repr(err)}"
@@ -401,18 +588,11 @@ def _do_news(channel):
     news.start_new_section()
     news.add_line(f"*Blogs:*")
     num = 0
-    for name, rss_feed in [
-        ("OpenAI Blog", "https://openai.com/blog/rss.xml"),
-        ("StabilityAI Blog", "https://stability.ai/news?format=rss"),
-        ("Microsoft Research", "https://www.microsoft.com/en-us/research/feed/"),
-        ("Deepmind Blog", "https://deepmind.google/blog/rss.xml"),
-        ("NVIDIA Blog", "https://feeds.feedburner.com/nvidiablog"),
-    ]:
-        news.set_progress_msg(f"Retrieving feed items from {name}")
-        for item in parse_rss.iter_items_from_today(rss_feed):
-            msg = f"{num + 1}. {name} | <{item['url']}|{item['title']}>"
-            num += 1
-            news.lazy_add_line(msg)
+    news.set_progress_msg("Retrieving feed items")
+    for name, item in parse_rss.iter_items_from_feeds(parse_rss.get_feeds()):
+        msg = f"{num + 1}. {name} | <{item['url']}|{item['title']}>"
+        num += 1
+        news.lazy_add_line(msg)
     if num == 0:
         news.add_line("_No blogs from today._")
 
@@ -420,14 +600,15 @@ def _do_news(channel):
     news.add_line("*arxiv AI papers:*")
     news.set_progress_msg("Retrieving papers")
     num = 0
-    total = 0
-    for paper in parse_arxiv.iter_todays_papers(category="cs.AI"):
+    papers = list(parse_arxiv.iter_todays_papers(category="cs.AI"))
+    total = len(papers)
+    news.set_progress_msg(f"Ranking {total} papers")
+    checked = 0
+    for paper, verdict in _filter_papers(papers, PAPER_FILTER):
+        checked += 1
         news.set_progress_msg(f"Processing <{paper['url']}|{paper['title']}>")
-        total += 1
         try:
-            should_show = lm.matches_filter(
-                "Abstract:\n" + paper["abstract"], PAPER_FILTER
-            )
+            should_show = verdict.result()
         except Exception as err:
             print(f"Error while processing {paper['url']}: {type(err)} {repr(err)}")
             continue
@@ -438,7 +619,7 @@ def _do_news(channel):
             news.lazy_add_line(msg)
     if num == 0:
         news.add_line("_No more relevant papers from today._")
-    news.add_line(f"_Checked {total} papers._")
+    news.add_line(_checked_papers_msg(checked, total))
     news.add_line("\n\nEnjoy reading 🎉")
 
 
@@ -449,14 +630,15 @@ def _arxiv_search(category, sub_category, description, channel):
 
     news.set_progress_msg("Retrieving papers")
     num = 0
-    total = 0
-    for paper in parse_arxiv.iter_todays_papers(category=f"{category}.{sub_category}"):
+    papers = list(parse_arxiv.iter_todays_papers(category=f"{category}.{sub_category}"))
+    total = len(papers)
+    news.set_progress_msg(f"Ranking {total} papers")
+    checked = 0
+    for paper, verdict in _filter_papers(papers, description):
+        checked += 1
         news.set_progress_msg(f"Processing <{paper['url']}|{paper['title']}>")
-        total += 1
         try:
-            should_show = lm.matches_filter(
-                "Abstract:\n" + paper["abstract"], description
-            )
+            should_show = verdict.result()
         except Exception as err:
             print(f"Error while processing {paper['url']}: {type(err)} {repr(err)}")
             continue
@@ -466,8 +648,9 @@ def _arxiv_search(category, sub_category, description, channel):
             news.lazy_add_line(msg)
     if num == 0:
         news.add_line("_No more relevant papers from today._")
-    news.add_line(f"_Checked {total} papers._")
+    news.add_line(_checked_papers_msg(checked, total))
     news.add_line("\n\nEnjoy reading 🎉")
+    news.flush()
 
 
 def _reddit_search(subreddit_name, description, channel):
@@ -476,7 +659,9 @@ def _reddit_search(subreddit_name, description, channel):
     news.set_progress_msg("Retrieving posts")
     num = 0
     total = 0
-    for post in parse_reddit.iter_top_posts(subreddit_name, num_posts=25):
+    for post, verdict in _filter_posts(
+        parse_reddit.iter_top_posts(subreddit_name, num_posts=25), description
+    ):
         if "error" in post:
             print(
                 f"Error while processing {post['comments_url']}: {type(post['error'])} {repr(post['error'])}"
@@ -485,9 +670,7 @@ def _reddit_search(subreddit_name, description, channel):
         news.set_progress_msg(f"Processing <{post['content_url']}|{post['title']}>")
         total += 1
         try:
-            should_show = lm.matches_filter(
-                post["title"] + "\n\n" + post["content"], description
-            )
+            should_show = verdict.result()
         except Exception as err:
             print(
                 f"Error while processing {post['comments_url']}: {type(err)} {repr(err)}"
@@ -500,6 +683,7 @@ def _reddit_search(subreddit_name, description, channel):
     if num == 0:
         news.add_line("_No more relevant posts from today._")
     news.add_line(f"_Checked {total} posts._")
+    news.flush()
 
 
 def _hackernews_search(description, channel):
@@ -507,7 +691,9 @@ def _hackernews_search(description, channel):
     news.set_progress_msg("Retrieving posts")
     num = 0
     total = 0
-    for post in parse_hn.iter_top_posts(num_posts=25):
+    for post, verdict in _filter_posts(
+        parse_hn.iter_top_posts(num_posts=25, timeout=HN_DEADLINE), description
+    ):
         if "error" in post:
             print(
                 f"Error while processing {post['comments_url']}: {type(post['error'])} {repr(post['error'])}"
@@ -516,9 +702,7 @@ def _hackernews_search(description, channel):
         news.set_progress_msg(f"Processing <{post['content_url']}|{post['title']}>")
         total += 1
         try:
-            should_show = lm.matches_filter(
-                post["title"] + "\n\n" + post["content"], description
-            )
+            should_show = verdict.result()
         except Exception as err:
             print(
                 f"Error while processing {post['comments_url']}: {type(err)} {repr(err)}"
@@ -532,17 +716,104 @@ def _hackernews_search(description, channel):
     if num == 0:
         news.add_line("_No more relevant posts from today._")
     news.add_line(f"_Checked {total} posts._")
+    news.flush()
+
+
+def _filter_posts(posts, description):
+    """
+    Runs `lm.matches_filter` on each post concurrently with crawling them.
+    Yields `(post, future)` in the original order.
+    """
+
+    def classify(post):
+        if "error" in post:
+            return None
+        return lm.matches_filter(post["title"] + "\n\n" + post["content"], description)
+
+    return pipeline.map_ordered(classify, posts, max_in_flight=LLM_CONCURRENCY)
+
+
+def _checked_papers_msg(checked, total):
+    if checked == total:
+        return f"_Checked {total} papers._"
+    return (
+        f"_Checked {checked} of {total} papers ({total - checked} skipped by prerank)._"
+    )
+
+
+def _prerank_papers(papers, description):
+    """
+    Drops papers that are clearly off-topic (by a local BM25 score against the description)
+    before any LLM calls. See PRERANK_TOP_K & PRERANK_MIN_SCORE.
+    """
+    return rank.prefilter(
+        papers,
+        [paper["title"] + "\n\n" + paper["abstract"] for paper in papers],
+        description,
+        top_k=PRERANK_TOP_K,
+        min_score=PRERANK_MIN_SCORE,
+    )
+
+
+def _filter_papers(papers, description):
+    """
+    Classifies paper abstracts in batches with `lm.matches_filter_batch`, skipping papers
+    that already have a verdict for this description and papers that `_prerank_papers` drops.
+    Yields `(paper, future)` in the original order.
+    """
+    known = {
+        paper["url"]: parse_arxiv.get_verdict(paper, description) for paper in papers
+    }
+    candidates = set(
+        paper["url"]
+        for paper in _prerank_papers(
+            [paper for paper in papers if known[paper["url"]] is None], description
+        )
+    )
+
+    def classify(batch):
+        verdicts = [known[paper["url"]] for paper in batch]
+        unknown = [i for i, verdict in enumerate(verdicts) if verdict is None]
+        if len(unknown) > 0:
+            new_verdicts = lm.matches_filter_batch(
+                ["Abstract:\n" + batch[i]["abstract"] for i in unknown], description
+            )
+            for i, verdict in zip(unknown, new_verdicts):
+                parse_arxiv.set_verdict(batch[i], description, verdict)
+                verdicts[i] = verdict
+        return verdicts
+
+    return pipeline.map_ordered_batched(
+        classify,
+        [
+            paper
+            for paper in papers
+            if known[paper["url"]] is not None or paper["url"] in candidates
+        ],
+        PAPER_BATCH_SIZE,
+        max_in_flight=LLM_CONCURRENCY,
+    )
 
 
 def _do_interactive(
     conversation, slack_msg: EditableMessage, model="gpt-3.5-turbo-16k"
 ):
-    from langchain.chat_models import ChatOpenAI
     from langchain.schema import HumanMessage, SystemMessage, AIMessage
 
-    chat = ChatOpenAI(model=model, request_timeout=30)
     app_user_id = app.client.auth_test()["user_id"]
 
+    # resolve every arxiv paper in the thread with a single api query up front,
+    # parse_arxiv.get_item below is then served from its cache.
+    parse_arxiv.get_items(
+        [
+            ele["url"]
+            for event in conversation
+            if event["user"] != app_user_id
+            for ele in event["blocks"][0]["elements"][0]["elements"]
+            if ele["type"] == "link" and "arxiv.org" in ele["url"]
+        ]
+    )
+
     arxiv_urls = {}
     messages = []
     for event in conversation:
@@ -582,38 +853,42 @@ def _do_interactive(
 
     additional_content = {}
     for url in arxiv_urls:
-        slack_msg.edit_line(f"_Downloading <{url}>..._")
-        path = parse_arxiv.download_pdf(url)
-
-        slack_msg.edit_line(f"_Parsing pdf..._")
-        pdf = parse_pdf.ParsedPdf(path)
+        slack_msg.edit_line(f"_Downloading & parsing <{url}>..._")
+        pdf = parse_arxiv.get_parsed_pdf(url)
+
+        # each section is read independently (without the rest of the conversation),
+        # and the relevant parts are then merged into the article's message below.
+        # like the answer itself, they are read by `model` on OpenAI (see `lm.chat`).
+        def extract(section):
+            return lm.extract_from_section(
+                section,
+                pdf.get_section(section),
+                conversation[-1]["text"],
+                model=model,
+                backend="openai",
+            )
 
         new_content = []
-        for section in pdf.section_names:
-            slack_msg.edit_line(f"_Reading section '{section}'..._")
-            messages.append(
-                SystemMessage(
-                    content=f"""[begin Section '{section}']
-{pdf.get_section(section)}
-[end Section '{section}']
-
-[begin Question]
-{conversation[-1]['text']}
-[end Question]
-
-Extract information from Section '{section}' that is relevant to the Question. The output should be a JSON dictionary with two keys. The first key should be the summary, and the second key should be a boolean value indicating whether there is useful information in the section. Here is an example output:
-{{"summary": "<example summary text...>", "relevant": false}}
-"""
-                )
+        num_sections = len(pdf.section_names)
+        slack_msg.edit_line(f"_Reading sections (0/{num_sections})..._")
+        for i, (section, extraction) in enumerate(
+            pipeline.map_ordered(
+                extract, pdf.section_names, max_in_flight=SECTION_CONCURRENCY
             )
-            extraction = chat(messages).content
-            extraction = json.loads(extraction)
-            print(section, "|", extraction)
+        ):
+            try:
+                extraction = extraction.result()
+            except Exception as err:
+                print(
+                    f"Error while reading section '{section}' of {url}: {type(err)} {repr(err)}"
+                )
+                continue
+            finally:
+                slack_msg.edit_line(f"_Reading sections ({i + 1}/{num_sections})..._")
             if extraction["relevant"]:
                 new_content.append(
                     f"[begin Section '{section}']\n{extraction['summary']}\n[end Section '{section}']"
                 )
-            messages.pop()
         additional_content[url] = "\n\n".join(new_content)
 
     for url, i_msg in arxiv_urls.items():
@@ -621,10 +896,13 @@ Extract information from Section '{section}' that is relevant to the Question. T
 
     try:
         slack_msg.edit_line("_Thinking..._")
-        response = chat(messages)
-        slack_msg.edit_line(response.content)
+        response = lm.chat(
+            messages, kind="chat", model=model, on_partial=slack_msg.stream_line()
+        )
+        slack_msg.edit_line(response)
     except Exception as err:
         slack_msg.edit_line(f"Sorry I encountered an error: {type(err)} {repr(err)}")
+    slack_msg.flush()
 
 
 if __name__ == "__main__":
@@ -633,4 +911,8 @@ if __name__ == "__main__":
     os.environ["MODEL"] = "openchat_3.5"
     os.environ["LLM_BACKEND"] = "openchat"
 
+    metrics.configure_logging()
+    metrics.start_server()
+    digest.DigestScheduler(digest.DIGEST_TIMES, _precompute_news).start()
+
     SocketModeHandler(app, os.environ["SLACK_APP_TOKEN"]).start()
@@ -0,0 +1,91 @@
+"""
+Compares the lxml extractor used by `util.get_details_from_url` with the old bs4 one
+on a fixed corpus of saved pages.
+
+    # save a corpus once (pages are stored as <corpus>/<n>.html)
+    python -m benchmarks.bench_extract --save urls.txt --corpus benchmarks/corpus
+
+    # then benchmark against it as often as needed
+    python -m benchmarks.bench_extract --corpus benchmarks/corpus
+"""
+import argparse
+import os
+import time
+
+from newsletter import util
+
+
+def save_corpus(urls_path, corpus):
+    os.makedirs(corpus, exist_ok=True)
+    with open(urls_path) as fp:
+        urls = [line.strip() for line in fp if line.strip() != ""]
+    for i, url in enumerate(urls):
+        try:
+            response = util.request("GET", url, headers=util._BROWSER_HEADERS)
+            response.raise_for_status()
+        except Exception as err:
+            print(f"Skipping {url}: {type(err)} {repr(err)}")
+            continue
+        with open(os.path.join(corpus, f"{i:03d}.html"), "wb") as fp:
+            fp.write(response.content)
+        print(f"Saved {url}")
+
+
+def load_corpus(corpus):
+    pages = []
+    for name in sorted(os.listdir(corpus)):
+        if name.endswith(".html"):
+            with open(os.path.join(corpus, name), "rb") as fp:
+                pages.append((name, fp.read()))
+    return pages
+
+
+def time_extractor(extract, html, repeat):
+    best = float("inf")
+    details = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            details = extract(html)
+        except util.ScrapePreventedError:
+            details = None
+        best = min(best, time.perf_counter() - start)
+    return best, details
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default="benchmarks/corpus")
+    parser.add_argument("--save", help="file of urls (one per line) to save first")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.save is not None:
+        save_corpus(args.save, args.corpus)
+
+    pages = load_corpus(args.corpus)
+    if len(pages) == 0:
+        print(f"No .html pages in {args.corpus}")
+        return
+
+    print(f"{'page':<24} {'bs4 ms':>9} {'lxml ms':>9} {'speedup':>8} {'chars':>14}")
+    total_old = total_new = 0.0
+    for name, html in pages:
+        old, old_details = time_extractor(util._extract_details_bs4, html, args.repeat)
+        new, new_details = time_extractor(util._extract_details, html, args.repeat)
+        total_old += old
+        total_new += new
+        chars = "/".join(
+            str(len(d["text"])) if d is not None else "-"
+            for d in (old_details, new_details)
+        )
+        print(
+            f"{name:<24} {old * 1e3:>9.2f} {new * 1e3:>9.2f} {old / new:>7.1f}x {chars:>14}"
+        )
+    print(
+        f"{'total':<24} {total_old * 1e3:>9.2f} {total_new * 1e3:>9.2f} {total_old / total_new:>7.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
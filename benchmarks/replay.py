@@ -0,0 +1,593 @@
+"""
+Offline benchmark of newsy's commands, against recorded responses.
+
+    # record the responses every stage needs once (needs network & the reddit credentials)
+    python -m benchmarks.replay record --fixtures benchmarks/fixtures
+
+    # then replay them as often as needed, with no network
+    python -m benchmarks.replay replay --fixtures benchmarks/fixtures --iterations 5 --llm-latency 0.5
+
+Every request made through `requests` (the scrapers, arxiv, praw, openai) is redirected to
+a local server: while recording the live response is stored as a fixture, while replaying
+the fixture is served instead. Slack's web api and the LLM backend behind `lm._call_llm`
+are always local stand-ins - the LLM answers after `--llm-latency` seconds with canned
+answers of the shape each prompt asks for. While replaying, the clocks of the parsers are
+set back to the recording time, so their date windows select the same items.
+"""
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+STAGES = ["news", "hackernews", "arxiv", "summarize", "interactive"]
+
+CHANNEL = "CREPLAY"
+BOT_USER = "UNEWSY"
+OPENCHAT_HOST = "openchat.replay"
+LLM_HOSTS = ("api.openai.com", OPENCHAT_HOST)
+
+# recorded bodies are stored decoded, so these no longer describe them
+_HOP_HEADERS = (
+    "connection",
+    "content-encoding",
+    "content-length",
+    "keep-alive",
+    "transfer-encoding",
+)
+
+_requests_by_host = Counter()
+_misses_by_host = Counter()
+_counts_lock = threading.Lock()
+
+
+def _count(counter, host):
+    with _counts_lock:
+        counter[host] += 1
+
+
+class Fixtures:
+    """
+    Recorded responses by method & url: an index.json, plus one file per distinct body.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.recorded_at = None
+        self.responses = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        with open(os.path.join(self.path, "index.json")) as fp:
+            data = json.load(fp)
+        self.recorded_at = data["recorded_at"]
+        self.responses = data["responses"]
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, "index.json"), "w") as fp:
+            json.dump(
+                {"recorded_at": self.recorded_at, "responses": self.responses},
+                fp,
+                indent=1,
+                sort_keys=True,
+            )
+
+    def get(self, method: str, url: str):
+        return self.responses.get(f"{method} {url}")
+
+    def add(self, method: str, url: str, status: int, headers, body: bytes):
+        digest = hashlib.sha256(body).hexdigest()
+        with self._lock:
+            # the first response is the one a cold run sees
+            if f"{method} {url}" in self.responses:
+                return
+            os.makedirs(os.path.join(self.path, "bodies"), exist_ok=True)
+            with open(os.path.join(self.path, "bodies", digest), "wb") as fp:
+                fp.write(body)
+            self.responses[f"{method} {url}"] = {
+                "status": status,
+                "headers": headers,
+                "body": digest,
+            }
+
+    def body(self, response) -> bytes:
+        with open(os.path.join(self.path, "bodies", response["body"]), "rb") as fp:
+            return fp.read()
+
+
+def fake_answer(prompt: str) -> str:
+    """
+    A canned answer in the format `prompt` asks for (see the prompts in `newsletter.lm`).
+    Yes/no answers are a deterministic ~25% yes, so that the filters let some items through.
+    """
+
+    def is_yes(*salt):
+        h = hashlib.sha256(repr((prompt,) + salt).encode()).digest()
+        return h[0] % 4 == 0
+
+    if "JSON dictionary mapping each Article number" in prompt:
+        num = len(re.findall(r"\[begin Article \d+\]", prompt))
+        return json.dumps(
+            {str(i + 1): "Yes" if is_yes(i) else "No" for i in range(num)}
+        )
+    if "JSON dictionary with two keys" in prompt:
+        return json.dumps(
+            {"summary": "The section describes the method.", "relevant": is_yes()}
+        )
+    if "Yes or No" in prompt:
+        return "Yes" if is_yes() else "No"
+    return "- The first main point.\n- The second main point.\n- The third main point."
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep connections alive like the real servers do, so pooling behaves the same
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _send(self, status: int, headers, body: bytes):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, data):
+        self._send(
+            200, [("Content-Type", "application/json")], json.dumps(data).encode()
+        )
+
+
+class FixtureHandler(_Handler):
+    """
+    Serves the recorded response of the url in the X-Replay-Url header.
+    """
+
+    fixtures: Fixtures = None
+
+    def do_GET(self):
+        self._replay("GET")
+
+    def do_POST(self):
+        self._replay("POST")
+
+    def _replay(self, method):
+        self._read_body()
+        url = self.headers["X-Replay-Url"]
+        response = self.fixtures.get(method, url)
+        if response is None:
+            _count(_misses_by_host, urlparse(url).netloc)
+            self._send(404, [], b"not recorded")
+            return
+
+        etag = [v for k, v in response["headers"] if k.lower() == "etag"]
+        if len(etag) > 0 and self.headers.get("If-None-Match") == etag[0]:
+            self._send(304, [("ETag", etag[0])], b"")
+            return
+        self._send(
+            response["status"], response["headers"], self.fixtures.body(response)
+        )
+
+
+class SlackHandler(_Handler):
+    """
+    Just enough of slack's web api for newsy to post & edit its messages.
+    """
+
+    conversation = []
+
+    def do_POST(self):
+        self._read_body()
+        _count(_requests_by_host, "slack.com")
+        method = urlparse(self.path).path.rsplit("/", 1)[-1]
+        if method == "auth.test":
+            self._send_json(
+                {
+                    "ok": True,
+                    "user_id": BOT_USER,
+                    "user": "newsy",
+                    "team_id": "TREPLAY",
+                    "bot_id": "BREPLAY",
+                }
+            )
+        elif method == "conversations.replies":
+            self._send_json(
+                {"ok": True, "messages": self.conversation, "has_more": False}
+            )
+        else:
+            self._send_json(
+                {"ok": True, "channel": CHANNEL, "ts": f"{time.time():.6f}"}
+            )
+
+    do_GET = do_POST
+
+
+class LLMHandler(_Handler):
+    """
+    OpenAI compatible chat completions & (batched) completions endpoints that answer
+    after `latency` seconds. Streamed chat completions spread that time evenly over
+    their words instead.
+    """
+
+    latency = 0.0
+    jitter = 0.0
+
+    def do_POST(self):
+        request = json.loads(self._read_body())
+        latency = self.latency * random.uniform(1 - self.jitter, 1 + self.jitter)
+        prompt = "\n".join(m["content"] for m in request.get("messages", []))
+        if request.get("stream"):
+            self._stream(request, fake_answer(prompt), latency)
+            return
+
+        time.sleep(latency)
+        if urlparse(self.path).path.endswith("/completions") and "prompt" in request:
+            self._complete(request)
+            return
+
+        content = fake_answer(prompt)
+        prompt_tokens, completion_tokens = len(prompt) // 4, len(content) // 4
+        self._send_json(
+            {
+                "id": "chatcmpl-replay",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            }
+        )
+
+    def _stream(self, request, content, latency):
+        pieces = re.findall(r"\S+\s*", content) or [""]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for piece in pieces + [None]:
+            if piece is not None:
+                time.sleep(latency / len(pieces))
+            chunk = {
+                "id": "chatcmpl-replay",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": request.get("model"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "delta": {} if piece is None else {"content": piece},
+                        "finish_reason": "stop" if piece is None else None,
+                    }
+                ],
+            }
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n".encode())
+        self._write_chunk(b"data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _complete(self, request):
+        prompts = request["prompt"]
+        if isinstance(prompts, str):
+            prompts = [prompts]
+        self._send_json(
+            {
+                "id": "cmpl-replay",
+                "object": "text_completion",
+                "created": int(time.time()),
+                "model": request.get("model"),
+                "choices": [
+                    {"index": i, "text": fake_answer(prompt), "finish_reason": "stop"}
+                    for i, prompt in enumerate(prompts)
+                ],
+            }
+        )
+
+
+def _serve(handler, **attrs) -> str:
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), type(handler.__name__, (handler,), attrs)
+    )
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def _install_transport(fixtures: Fixtures, fixture_url: str, llm_url: str, record):
+    """
+    Routes every request sent by a `requests` adapter through the stand-in servers.
+    """
+    import urllib3
+    from requests.adapters import HTTPAdapter
+
+    send = HTTPAdapter.send
+
+    def replay_send(adapter, request, **kwargs):
+        url = request.url
+        parts = urlparse(url)
+        _count(_requests_by_host, parts.netloc)
+
+        if parts.netloc in LLM_HOSTS:
+            target = llm_url
+        elif record:
+            response = send(adapter, request, **kwargs)
+            body = response.content
+            headers = [
+                (k, v)
+                for k, v in response.headers.items()
+                if k.lower() not in _HOP_HEADERS
+            ]
+            fixtures.add(request.method, url, response.status_code, headers, body)
+            # the body was consumed above, so hand back a copy that can still be streamed
+            raw = urllib3.HTTPResponse(
+                body=io.BytesIO(body),
+                headers=headers,
+                status=response.status_code,
+                reason=response.reason,
+                preload_content=False,
+            )
+            return adapter.build_response(request, raw)
+        else:
+            target = fixture_url
+
+        local = request.copy()
+        local.url = (
+            target + (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        )
+        local.headers["X-Replay-Url"] = url
+        response = send(adapter, local, **kwargs)
+        response.url = url
+        response.request = request
+        return response
+
+    HTTPAdapter.send = replay_send
+
+
+def _set_clocks(recorded_at: str):
+    """
+    Makes the date windows of the parsers behave as they did at `recorded_at`.
+    """
+    from newsletter import parse_arxiv, parse_rss
+
+    offset = datetime.fromisoformat(recorded_at) - datetime.now(timezone.utc)
+
+    class RecordedDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.now(tz) + offset
+
+        @classmethod
+        def utcnow(cls):
+            return datetime.utcnow() + offset
+
+    parse_arxiv.datetime = RecordedDatetime
+    parse_rss.datetime = RecordedDatetime
+
+
+def _conversation(url: str, question: str):
+    return [
+        {
+            "user": "UREPLAY",
+            "ts": "1.0",
+            "text": f"<{url}> {question}",
+            "blocks": [
+                {
+                    "type": "rich_text",
+                    "elements": [
+                        {
+                            "type": "rich_text_section",
+                            "elements": [
+                                {"type": "link", "url": url},
+                                {"type": "text", "text": " " + question},
+                            ],
+                        }
+                    ],
+                }
+            ],
+        }
+    ]
+
+
+def _run_stage(newsy, name: str, args):
+    from newsletter.slack import EditableMessage
+
+    client = newsy.app.client
+    if name == "news":
+        newsy._do_news(channel=CHANNEL)
+    elif name == "hackernews":
+        newsy._hackernews_search(
+            args.description or newsy.ARTICLE_FILTER, channel=CHANNEL
+        )
+    elif name == "arxiv":
+        category, sub_category = args.arxiv_category.split(".")
+        newsy._arxiv_search(
+            category, sub_category, args.description or newsy.PAPER_FILTER, CHANNEL
+        )
+    elif name == "summarize":
+        newsy._do_summarize(
+            args.summarize_url,
+            EditableMessage(client, CHANNEL, "_Working on it..._", ts="1.0"),
+        )
+    elif name == "interactive":
+        newsy._do_interactive(
+            SlackHandler.conversation,
+            EditableMessage(client, CHANNEL, "_Let me check..._", ts="1.0"),
+        )
+    else:
+        raise ValueError(f"Unknown stage: '{name}'")
+
+
+def _percentile(values, p):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def _report(results, iterations, baseline=None):
+    print(f"\n{'stage':<12} {'p50 s':>8} {'p95 s':>8} {'min s':>8} {'max s':>8}")
+    for name, result in results.items():
+        line = f"{name:<12} {result['p50']:>8.2f} {result['p95']:>8.2f} {min(result['runs']):>8.2f} {max(result['runs']):>8.2f}"
+        if result["errors"] > 0:
+            line += f"  ({result['errors']} failed)"
+        if baseline is not None and name in baseline:
+            line += (
+                f"  ({result['p50'] / baseline[name]['p50'] - 1:+.0%} p50 vs baseline)"
+            )
+        print(line)
+
+    print(f"\nrequests per run by host:")
+    for name, result in results.items():
+        print(f"  {name}:")
+        for host, count in sorted(result["requests"].items(), key=lambda kv: -kv[1]):
+            missed = result["misses"].get(host, 0)
+            note = f" ({missed / iterations:g} not recorded)" if missed > 0 else ""
+            print(f"    {count / iterations:>8g}  {host}{note}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("--fixtures", default="benchmarks/fixtures")
+    parser.add_argument("--stages", default=",".join(STAGES))
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument(
+        "--warm", action="store_true", help="keep caches between iterations"
+    )
+    parser.add_argument(
+        "--llm-backend", choices=["openai", "openchat"], default="openai"
+    )
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--llm-jitter", type=float, default=0.0)
+    parser.add_argument("--description", default=None)
+    parser.add_argument("--arxiv-category", default="cs.AI")
+    parser.add_argument(
+        "--summarize-url",
+        default="https://en.wikipedia.org/wiki/Transformer_(deep_learning_architecture)",
+    )
+    parser.add_argument("--interactive-url", default="https://arxiv.org/abs/1706.03762")
+    parser.add_argument(
+        "--question", default="What attention mechanism does the paper propose?"
+    )
+    parser.add_argument("--output", help="write the results to this json file")
+    parser.add_argument("--baseline", help="compare against an earlier --output")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    record = args.mode == "record"
+    stages = [s.strip() for s in args.stages.split(",") if s.strip() != ""]
+    iterations = 1 if record else args.iterations
+
+    fixtures = Fixtures(args.fixtures)
+    if record:
+        fixtures.recorded_at = datetime.now(timezone.utc).isoformat()
+    else:
+        fixtures.load()
+
+    # everything newsy reads its configuration from at import time has to be set up first
+    cache_dir = tempfile.mkdtemp(prefix="newsy-replay-")
+    os.environ["NEWSY_CACHE_DIR"] = cache_dir
+    # so that tiktoken's encoding is downloaded (and recorded) too
+    os.environ["TIKTOKEN_CACHE_DIR"] = os.path.join(cache_dir, "tiktoken")
+    os.environ["LLM_BACKEND"] = args.llm_backend
+    os.environ["OPENCHAT_BASE_URL"] = f"http://{OPENCHAT_HOST}"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-replay")
+    os.environ["SLACK_BOT_TOKEN"] = "xoxb-replay"
+    for name in ("CLIENT_ID", "CLIENT_SECRET", "PASSWORD", "USERNAME"):
+        os.environ.setdefault(f"REDDIT_{name}", "replay")
+
+    SlackHandler.conversation = _conversation(args.interactive_url, args.question)
+    os.environ["SLACK_API_URL"] = _serve(SlackHandler) + "/api/"
+    llm_url = _serve(LLMHandler, latency=args.llm_latency, jitter=args.llm_jitter)
+    fixture_url = _serve(FixtureHandler, fixtures=fixtures)
+    _install_transport(fixtures, fixture_url, llm_url, record)
+
+    import app as newsy
+    from newsletter import cache, metrics, parse_arxiv
+
+    if not record:
+        _set_clocks(fixtures.recorded_at)
+
+    results = {}
+    try:
+        for name in stages:
+            runs = []
+            errors = 0
+            requests = Counter()
+            misses = Counter()
+            for i in range(iterations):
+                if i == 0 or not args.warm:
+                    cache.clear_all()
+                    shutil.rmtree(parse_arxiv.ARXIV_STORE_DIR, ignore_errors=True)
+                _requests_by_host.clear()
+                _misses_by_host.clear()
+
+                output = sys.stdout if args.verbose else io.StringIO()
+                start = time.perf_counter()
+                try:
+                    with contextlib.redirect_stdout(output), metrics.command(name):
+                        _run_stage(newsy, name, args)
+                except Exception as err:
+                    errors += 1
+                    print(f"Error in {name}: {type(err)} {repr(err)}", file=sys.stderr)
+                runs.append(time.perf_counter() - start)
+
+                requests.update(_requests_by_host)
+                misses.update(_misses_by_host)
+                print(f"{name} #{i + 1}: {runs[-1]:.2f}s", file=sys.stderr)
+
+            results[name] = {
+                "runs": runs,
+                "p50": _percentile(runs, 50),
+                "p95": _percentile(runs, 95),
+                "errors": errors,
+                "requests": dict(requests),
+                "misses": dict(misses),
+            }
+    finally:
+        if record:
+            fixtures.save()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+    _report(results, iterations, baseline)
+
+    if args.output is not None:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class MicroBatcher:
+    """
+    Collects items submitted by concurrent threads and hands them to `send` in batches.
+    A batch goes out `window` seconds after its first item arrived, or as soon as it holds
+    `max_batch` items. `send(items)` must return one result per item.
+    """
+
+    def __init__(self, send, window: float, max_batch: int, max_in_flight=4) -> None:
+        self.send = send
+        self.window = window
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._pending = []
+        self._pool = ThreadPoolExecutor(max_in_flight)
+        self._thread = None
+
+    def submit(self, item):
+        """
+        Blocks until the result for `item` is ready, or raises the error of its batch.
+        """
+        future = Future()
+        with self._cond:
+            self._pending.append((item, future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+        return future.result()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._pending) > 0)
+                deadline = time.monotonic() + self.window
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[: self.max_batch]
+                del self._pending[: self.max_batch]
+            # the next batch can fill up while this one is in flight
+            self._pool.submit(self._send, batch)
+
+    def _send(self, batch):
+        try:
+            results = self.send([item for item, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"Expected {len(batch)} results, got {len(results)}")
+        except Exception as err:
+            for _, future in batch:
+                future.set_exception(err)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
@@ -0,0 +1,127 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+
+CACHE_DIR = os.path.expanduser(os.environ.get("NEWSY_CACHE_DIR", "~/.cache/newsy"))
+
+_instances = weakref.WeakSet()
+
+
+class DiskCache:
+    """
+    A small sqlite backed key/value store. Values must be json serializable.
+    Once the stored values exceed `max_bytes`, the least recently used entries are evicted.
+    """
+
+    def __init__(self, name: str, max_bytes: int) -> None:
+        self.name = name
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        self._lock = threading.Lock()
+        _instances.add(self)
+
+    def _conn(self):
+        # connect lazily so that importing a module with a cache has no side effects
+        if self._db is None:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            self._db = sqlite3.connect(
+                os.path.join(CACHE_DIR, f"{self.name}.sqlite"),
+                check_same_thread=False,
+            )
+            self._db.execute("PRAGMA journal_mode=WAL")
+            # it's a cache - losing the last few writes on power loss is fine
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                """CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    stored_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)"
+            )
+            self._db.commit()
+        return self._db
+
+    def get(self, key: str, max_age=None):
+        """
+        Returns `(value, stored_at)`, or None if `key` is missing or was stored more
+        than `max_age` seconds ago.
+        """
+        with self._lock:
+            db = self._conn()
+            row = db.execute(
+                "SELECT value, stored_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (max_age is not None and time.time() - row[1] > max_age):
+                self.misses += 1
+                return None
+            db.execute(
+                "UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key)
+            )
+            db.commit()
+            self.hits += 1
+        return json.loads(row[0]), row[1]
+
+    def set(self, key: str, value) -> None:
+        data = json.dumps(value)
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now),
+            )
+            self._evict(db)
+            db.commit()
+
+    def touch(self, key: str) -> None:
+        """
+        Marks `key` as freshly stored, e.g. after a server said it hasn't changed.
+        """
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            db.execute(
+                "UPDATE entries SET stored_at = ?, accessed_at = ? WHERE key = ?",
+                (now, now, key),
+            )
+            db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            db = self._conn()
+            db.execute("DELETE FROM entries")
+            db.commit()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+    def _evict(self, db: sqlite3.Connection):
+        (total,) = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+        if total <= self.max_bytes:
+            return
+        rows = db.execute(
+            "SELECT key, size FROM entries ORDER BY accessed_at ASC"
+        ).fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            db.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+
+
+def clear_all() -> None:
+    """
+    Empties every cache in the process, e.g. to benchmark cold runs.
+    """
+    for cache in list(_instances):
+        cache.clear()
@@ -0,0 +1,67 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from . import metrics
+from .cache import DiskCache
+
+# `news` posts the stored digest right away, and refreshes it in the background
+# if it is older than this many seconds
+DIGEST_REFRESH_AGE = int(os.environ.get("NEWSY_DIGEST_REFRESH_AGE", 10 * 60))
+
+# UTC times ("HH:MM", comma separated) at which the digest is precomputed every day
+DIGEST_TIMES = [
+    t.strip()
+    for t in os.environ.get("NEWSY_DIGEST_TIMES", "06:00").split(",")
+    if t.strip() != ""
+]
+
+_store = DiskCache("digests", max_bytes=16 * 2**20)
+
+
+def load(name: str, max_age=None):
+    """
+    Returns `(sections, stored_at)` of the last digest saved under `name`, or None
+    if there isn't one (younger than `max_age` seconds, if given).
+    """
+    return _store.get(name, max_age=max_age)
+
+
+def save(name: str, sections) -> None:
+    _store.set(name, sections)
+
+
+class DigestScheduler:
+    """
+    Calls `build` from a background thread at each of `times` ("HH:MM" in UTC) every day.
+    """
+
+    def __init__(self, times, build) -> None:
+        self.times = [datetime.strptime(t, "%H:%M").time() for t in times]
+        self.build = build
+        self._thread = None
+
+    def start(self):
+        if len(self.times) == 0:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def seconds_until_next_run(self, now: datetime) -> float:
+        candidates = []
+        for t in self.times:
+            run_at = datetime.combine(now.date(), t)
+            if run_at <= now:
+                run_at += timedelta(days=1)
+            candidates.append(run_at)
+        return (min(candidates) - now).total_seconds()
+
+    def _run(self):
+        while True:
+            time.sleep(self.seconds_until_next_run(datetime.utcnow()))
+            try:
+                with metrics.command("digest"):
+                    self.build()
+            except Exception as err:
+                print(f"Error while precomputing digest: {type(err)} {repr(err)}")
@@ -0,0 +1,147 @@
+import re
+from collections import defaultdict
+
+import lxml.html
+from lxml import etree
+
+# never part of an article, removed before scoring
+_JUNK_TAGS = (
+    "script",
+    "style",
+    "noscript",
+    "template",
+    "iframe",
+    "svg",
+    "canvas",
+    "form",
+    "button",
+    "nav",
+    "footer",
+    "aside",
+)
+
+# tags whose text we score as paragraphs, and which are put on their own lines in the output
+_PARAGRAPH_TAGS = ("p", "pre", "td", "blockquote")
+_BLOCK_TAGS = _PARAGRAPH_TAGS + (
+    "h1",
+    "h2",
+    "h3",
+    "h4",
+    "h5",
+    "h6",
+    "li",
+    "div",
+    "section",
+    "article",
+    "br",
+    "tr",
+)
+
+_POSITIVE_RE = re.compile(
+    r"article|body|content|entry|main|page|post|story|text|blog", re.I
+)
+_NEGATIVE_RE = re.compile(
+    r"banner|breadcrumb|comment|cookie|footer|header|menu|modal|nav|newsletter|popup"
+    r"|promo|related|share|sidebar|social|sponsor|subscribe|widget",
+    re.I,
+)
+_SPACES_RE = re.compile(r"[ \t\r\f\v\xa0]+")
+
+
+def extract_details(html: bytes):
+    """
+    Finds the main content of a page readability style: each paragraph adds to the score
+    of its parent & grandparent (by length & number of commas), class/id names nudge scores
+    up or down, and the best block (discounted by its link density) wins.
+
+    Returns `{"title": ..., "text": ...}`, or None if nothing on the page looks like content.
+    """
+    try:
+        doc = lxml.html.document_fromstring(html)
+    except (etree.ParserError, ValueError):
+        return None
+
+    title = (doc.findtext(".//title") or "").strip()
+
+    etree.strip_elements(doc, etree.Comment, *_JUNK_TAGS, with_tail=False)
+    best = _best_candidate(doc)
+    if best is None:
+        return None
+
+    # boilerplate (comments, share bars, ...) is removed before the final scoring, unless
+    # it wraps the best block or most of its text, like a `<div class="container has-comments">`
+    keep = set(best.iterancestors()) | {best}
+    best_length = len(best.text_content())
+    dropped = False
+    for element in list(doc.iter("header", "div", "section", "ul")):
+        if (
+            element in keep
+            or element.getparent() is None
+            or _class_weight(element) >= 0
+        ):
+            continue
+        if best in element.iterancestors() and (
+            len(element.text_content()) > best_length / 2
+        ):
+            continue
+        element.drop_tree()
+        dropped = True
+    if dropped:
+        best = _best_candidate(doc)
+        if best is None:
+            return None
+
+    for element in best.iter(*_BLOCK_TAGS):
+        element.tail = "\n" + (element.tail or "")
+    lines = (
+        _SPACES_RE.sub(" ", line).strip() for line in best.text_content().split("\n")
+    )
+    text = "\n".join(line for line in lines if line != "")
+
+    return {"title": title, "text": text}
+
+
+def _best_candidate(doc):
+    scores = defaultdict(float)
+    for paragraph in doc.iter(*_PARAGRAPH_TAGS):
+        text = paragraph.text_content().strip()
+        if len(text) < 25:
+            continue
+        score = 1 + text.count(",") + min(len(text) // 100, 3)
+
+        parent = paragraph.getparent()
+        if parent is None:
+            continue
+        if parent not in scores:
+            scores[parent] = _class_weight(parent)
+        scores[parent] += score
+
+        grandparent = parent.getparent()
+        if grandparent is not None:
+            if grandparent not in scores:
+                scores[grandparent] = _class_weight(grandparent)
+            scores[grandparent] += score / 2
+
+    if len(scores) == 0:
+        return None
+    return max(scores, key=lambda e: scores[e] * (1 - _link_density(e)))
+
+
+def _class_weight(element) -> float:
+    names = f"{element.get('class', '')} {element.get('id', '')}"
+    if names.strip() == "":
+        return 0
+    weight = 0
+    if _POSITIVE_RE.search(names):
+        weight += 25
+    if _NEGATIVE_RE.search(names):
+        weight -= 25
+    return weight
+
+
+def _link_density(element) -> float:
+    text_length = len(element.text_content())
+    if text_length == 0:
+        return 1
+    link_length = sum(len(a.text_content()) for a in element.iter("a"))
+    return link_length / text_length
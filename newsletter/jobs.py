@@ -0,0 +1,76 @@
+import itertools
+import threading
+from collections import Counter, OrderedDict
+
+
+class JobQueue:
+    """
+    Runs jobs on a bounded pool of worker threads.
+
+    Jobs with a lower `priority` run first, at most `max_per_channel` jobs of the same
+    channel run at once, and a job whose `key` was already submitted (e.g. an event
+    that slack redelivered) is dropped.
+    """
+
+    def __init__(self, num_workers: int, max_per_channel: int, num_keys=10_000):
+        self.num_workers = num_workers
+        self.max_per_channel = max_per_channel
+        self.num_keys = num_keys
+        self._cond = threading.Condition()
+        self._jobs = []
+        self._running = Counter()
+        self._seen_keys = OrderedDict()
+        self._seq = itertools.count()
+        self._workers = []
+
+    def submit(self, fn, priority: int, channel: str, key=None) -> bool:
+        """
+        Queues `fn()` to run. Returns False if it was a duplicate of an earlier job.
+        """
+        with self._cond:
+            if key is not None:
+                if key in self._seen_keys:
+                    return False
+                self._seen_keys[key] = True
+                if len(self._seen_keys) > self.num_keys:
+                    self._seen_keys.popitem(last=False)
+
+            self._jobs.append((priority, next(self._seq), channel, fn))
+            if len(self._workers) < self.num_workers:
+                worker = threading.Thread(target=self._work, daemon=True)
+                self._workers.append(worker)
+                worker.start()
+            self._cond.notify_all()
+        return True
+
+    def _next_job(self):
+        # the highest priority (then oldest) job whose channel isn't at its limit
+        runnable = [
+            job for job in self._jobs if self._running[job[2]] < self.max_per_channel
+        ]
+        if len(runnable) == 0:
+            return None
+        job = min(runnable, key=lambda job: job[:2])
+        self._jobs.remove(job)
+        return job
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job()
+                _, _, channel, fn = job
+                self._running[channel] += 1
+
+            try:
+                fn()
+            except Exception as err:
+                print(f"Error while running job: {type(err)} {repr(err)}")
+            finally:
+                with self._cond:
+                    self._running[channel] -= 1
+                    if self._running[channel] == 0:
+                        del self._running[channel]
+                    self._cond.notify_all()
@@ -1,32 +1,444 @@
+import contextvars
 import os
+import re
+import json
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from urllib.parse import urlparse
+import openai
+from openai import api_requestor
+import requests
+from requests.adapters import HTTPAdapter
 from langchain.chat_models import ChatOpenAI
+from langchain.schema import AIMessage, HumanMessage
 from openai.error import InvalidRequestError
 
-def _call_llm(*args, model="gpt-3.5-turbo-16k", **kwargs):
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
 
-    if os.environ["LLM_BACKEND"] == "openchat":
-        openai_api_base = f'{os.environ["OPENCHAT_BASE_URL"]}/v1'
+from . import metrics, usage, util
+from .batching import MicroBatcher
+from .cache import DiskCache
+
+# max prompt tokens we put into one batched classification request
+BATCH_TOKEN_BUDGET = int(os.environ.get("NEWSY_BATCH_TOKEN_BUDGET", 12000))
+
+_CONTEXT_SIZES = {
+    "gpt-3.5-turbo-16k": 16385,
+    "gpt-4-32k": 32768,
+    "openchat_3.5": 8192,
+}
+# tokens left free in the context for the model's answer
+_COMPLETION_RESERVE = 1024
+
+# content longer than this many tokens is summarized in chunks of SUMMARY_CHUNK_TOKENS
+# (concurrently), and then the chunk summaries are summarized.
+SUMMARY_TOKEN_BUDGET = int(os.environ.get("NEWSY_SUMMARY_TOKEN_BUDGET", 6000))
+SUMMARY_CHUNK_TOKENS = int(os.environ.get("NEWSY_SUMMARY_CHUNK_TOKENS", 4000))
+SUMMARY_CONCURRENCY = int(os.environ.get("NEWSY_SUMMARY_CONCURRENCY", 4))
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+# connections kept alive to the LLM apis, shared by all clients
+LLM_POOL_SIZE = int(os.environ.get("NEWSY_LLM_POOL_SIZE", 16))
+
+_session = None
+_session_lock = threading.Lock()
+_clients = {}
+_batchers = {}
+_clients_lock = threading.Lock()
+
+# openchat prompts sent within this many seconds of each other go out as a single
+# batched completion request. 0 disables batching.
+OPENCHAT_BATCH_WINDOW = float(os.environ.get("NEWSY_OPENCHAT_BATCH_WINDOW", 0.02))
+OPENCHAT_MAX_BATCH = int(os.environ.get("NEWSY_OPENCHAT_MAX_BATCH", 16))
+# turned off for good if the server turns out not to have the completions endpoint.
+# prompts of a batch that fails for any other reason are sent one by one instead.
+_openchat_batching = True
+_OPENCHAT_TEMPLATE = "GPT4 Correct User: {prompt}<|end_of_turn|>GPT4 Correct Assistant:"
+
+# deterministic (temperature 0) responses are memoized on disk for this many seconds
+LLM_CACHE_TTL = int(os.environ.get("NEWSY_LLM_CACHE_TTL", 7 * 24 * 60 * 60))
+_response_cache = DiskCache(
+    "llm", max_bytes=int(os.environ.get("NEWSY_LLM_CACHE_MAX_BYTES", 128 * 2**20))
+)
+
+
+def cache_stats():
+    return _response_cache.stats()
+
+
+def _call_llm(
+    prompt,
+    model="gpt-3.5-turbo-16k",
+    temperature=0.0,
+    kind="other",
+    backend=None,
+    on_partial=None,
+    **kwargs,
+):
+    """
+    Sends `prompt` (a string or a list of messages) to `backend`, LLM_BACKEND by default.
+    Every call is accounted in `usage` under `kind`, the type of prompt.
+
+    With `on_partial`, the reply is streamed: `on_partial(text)` is called with the
+    reply so far every time more of it arrives.
+    """
+    if backend is None:
+        backend = os.environ.get("LLM_BACKEND", "openai")
+    escalated = False
+    if backend == "openchat":
         model = "openchat_3.5"
-        llm = ChatOpenAI(
-            temperature=0.0,
-            model_name=model,
-            openai_api_base=openai_api_base,
-            verbose=True,
-        )
-        return llm.invoke(*args, **kwargs)
+    elif model == "gpt-3.5-turbo-16k":
+        # pick the model from the size of the prompt up front, rather than waiting
+        # for a context_length_exceeded error.
+        num_tokens = _count_prompt_tokens(prompt)
+        if num_tokens + _COMPLETION_RESERVE > _CONTEXT_SIZES[model]:
+            model = "gpt-4-32k"
+            escalated = True
+
+    start = time.perf_counter()
+    key = None
+    if temperature == 0:
+        key = _cache_key(backend, model, temperature, (prompt,), kwargs)
+        cached = _response_cache.get(key, max_age=LLM_CACHE_TTL)
+        if cached is not None:
+            usage.record(
+                kind,
+                model,
+                time.perf_counter() - start,
+                cached=True,
+                escalated=escalated,
+            )
+            if on_partial is not None:
+                on_partial(cached[0])
+            return AIMessage(content=cached[0])
 
-    elif model in ("gpt-3.5-turbo-16k", "gpt-4-32k"):
+    try:
         try:
-            return ChatOpenAI(model=model, request_timeout=30).invoke(*args, **kwargs)
+            result, token_usage = _reply(
+                backend, model, temperature, prompt, kind, start, on_partial, kwargs
+            )
         except InvalidRequestError as err:
-            if err.code == "context_length_exceeded" and "32k" not in model:
-                return _call_llm(*args, model="gpt-4-32k", **kwargs)
-            raise
-    else:
-        raise Exception(f"Invalid model: '{model}'")
+            # the token count above is an estimate (a rough one without tiktoken), so the
+            # prompt may still turn out too long for the default model
+            if err.code != "context_length_exceeded" or model != "gpt-3.5-turbo-16k":
+                raise
+            model = "gpt-4-32k"
+            escalated = True
+            result, token_usage = _reply(
+                backend, model, temperature, prompt, kind, start, on_partial, kwargs
+            )
+    except Exception:
+        usage.record(
+            kind, model, time.perf_counter() - start, escalated=escalated, error=True
+        )
+        raise
+
+    # not every backend reports usage, so fall back to counting ourselves
+    prompt_tokens = token_usage.get("prompt_tokens")
+    if prompt_tokens is None:
+        prompt_tokens = _count_prompt_tokens(prompt)
+    completion_tokens = token_usage.get("completion_tokens")
+    if completion_tokens is None:
+        completion_tokens = count_tokens(result.content)
+    usage.record(
+        kind,
+        model,
+        time.perf_counter() - start,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        escalated=escalated,
+    )
+
+    if key is not None:
+        _response_cache.set(key, result.content)
+    return result
+
+
+def _reply(backend, model, temperature, prompt, kind, start, on_partial, kwargs):
+    """
+    Returns the reply & the token usage, streaming the reply to `on_partial` if it's set.
+    """
+    if on_partial is None:
+        return _invoke_llm(backend, model, temperature, prompt, **kwargs)
+
+    content = None
+    for partial in _stream_llm(backend, model, temperature, prompt, **kwargs):
+        if content is None:
+            usage.LLM_FIRST_TOKEN_SECONDS.observe(
+                time.perf_counter() - start, kind=kind, model=model
+            )
+        content = partial
+        on_partial(content)
+    # streamed replies don't report usage
+    return AIMessage(content=content or ""), {}
+
+
+def _invoke_llm(backend, model, temperature, prompt, **kwargs):
+    """
+    Returns the reply & the token usage reported by the api (which may be empty).
+    """
+    host = _api_host(backend, model)
+    if backend == "openchat" and isinstance(prompt, str) and len(kwargs) == 0:
+        if OPENCHAT_BATCH_WINDOW > 0 and _openchat_batching:
+            try:
+                with metrics.span("llm_request", host=host):
+                    content = _get_batcher(model, temperature).submit(prompt)
+                return AIMessage(content=content), {}
+            except Exception as err:
+                print(
+                    f"Batched openchat completion failed, sending the prompt on its own: {type(err)} {repr(err)}"
+                )
+
+    if isinstance(prompt, str):
+        prompt = [HumanMessage(content=prompt)]
+    with metrics.span("llm_request", host=host):
+        result = _get_client(backend, model, temperature).generate([prompt], **kwargs)
+    token_usage = (result.llm_output or {}).get("token_usage") or {}
+    return result.generations[0][0].message, token_usage
+
+
+def _stream_llm(backend, model, temperature, prompt, **kwargs):
+    """
+    Yields the reply to `prompt` as it is generated, the whole reply so far each time.
+    Streamed prompts are never batched, they are sent on their own as soon as possible.
+    """
+    host = _api_host(backend, model)
+    if isinstance(prompt, str):
+        prompt = [HumanMessage(content=prompt)]
+    content = ""
+    with metrics.span("llm_request", host=host):
+        for chunk in _get_client(backend, model, temperature).stream(prompt, **kwargs):
+            if len(chunk.content) == 0:
+                continue
+            content += chunk.content
+            yield content
+
+
+def _api_host(backend, model):
+    if backend == "openchat":
+        return urlparse(os.environ["OPENCHAT_BASE_URL"]).netloc
+    if model in ("gpt-3.5-turbo-16k", "gpt-4-32k"):
+        return "api.openai.com"
+    raise Exception(f"Invalid model: '{model}'")
+
+
+def _get_client(backend, model, temperature) -> ChatOpenAI:
+    """
+    One client per backend, model & temperature for the whole process. All of them send
+    their requests through the pooled `_get_session()`, so connections are kept alive
+    between calls.
+    """
+    key = (backend, model, temperature)
+    with _clients_lock:
+        if key not in _clients:
+            if backend == "openchat":
+                _clients[key] = ChatOpenAI(
+                    client=_PooledChatCompletion(),
+                    temperature=temperature,
+                    model_name=model,
+                    openai_api_base=f'{os.environ["OPENCHAT_BASE_URL"]}/v1',
+                    verbose=True,
+                )
+            else:
+                _clients[key] = ChatOpenAI(
+                    client=_PooledChatCompletion(),
+                    model=model,
+                    temperature=temperature,
+                    request_timeout=30,
+                )
+        return _clients[key]
+
+
+def _get_session() -> requests.Session:
+    """
+    The session every LLM request goes through. Nothing is retried at this level:
+    completions aren't idempotent, and langchain already retries failed calls itself.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            adapter = HTTPAdapter(
+                pool_connections=4, pool_maxsize=LLM_POOL_SIZE, max_retries=0
+            )
+            _session = requests.Session()
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+class _PooledChatCompletion:
+    """
+    Stands in for `openai.ChatCompletion` as the client of a ChatOpenAI, sending its
+    requests through `_get_session()` rather than the session openai uses everywhere else.
+    """
+
+    def create(self, **kwargs):
+        # openai (< 1.0) only takes a session per thread, so ours is swapped in for this call.
+        # the request is sent before create returns, even for streamed replies.
+        context = api_requestor._thread_context
+        previous = context.__dict__.copy()
+        context.session = _get_session()
+        # a fresh create time, so that openai doesn't "recycle" (close) our session
+        context.session_create_time = time.time()
+        try:
+            return openai.ChatCompletion.create(**kwargs)
+        finally:
+            context.__dict__.clear()
+            context.__dict__.update(previous)
+
+
+def _get_batcher(model, temperature) -> MicroBatcher:
+    key = (model, temperature)
+    with _clients_lock:
+        if key not in _batchers:
+            _batchers[key] = MicroBatcher(
+                lambda prompts: _complete_openchat_batch(model, temperature, prompts),
+                window=OPENCHAT_BATCH_WINDOW,
+                max_batch=OPENCHAT_MAX_BATCH,
+            )
+        return _batchers[key]
+
+
+def _complete_openchat_batch(model, temperature, prompts: List[str]) -> List[str]:
+    """
+    Completes all of `prompts` with one request, using the completions endpoint
+    (which, unlike chat completions, takes a list of prompts).
+    """
+    global _openchat_batching
+    response = _get_session().post(
+        f'{os.environ["OPENCHAT_BASE_URL"]}/v1/completions',
+        json={
+            "model": model,
+            "prompt": [_OPENCHAT_TEMPLATE.format(prompt=p) for p in prompts],
+            "temperature": temperature,
+            "max_tokens": _COMPLETION_RESERVE,
+            "stop": ["<|end_of_turn|>"],
+        },
+        timeout=(util.DEFAULT_TIMEOUT[0], 120),
+    )
+    if response.status_code in (404, 405):
+        # this server has no completions endpoint, stick to chat completions from now on
+        _openchat_batching = False
+    response.raise_for_status()
+    choices = sorted(response.json()["choices"], key=lambda choice: choice["index"])
+    return [choice["text"].strip() for choice in choices]
+
+
+def _cache_key(backend, model, temperature, args, kwargs):
+    def _serialize(value):
+        if isinstance(value, str):
+            return value
+        if isinstance(value, (list, tuple)):
+            return [_serialize(v) for v in value]
+        if hasattr(value, "content"):
+            # a langchain message
+            return [type(value).__name__, value.content]
+        return repr(value)
+
+    payload = json.dumps(
+        [
+            backend,
+            model,
+            temperature,
+            _serialize(args),
+            sorted(kwargs.items(), key=str),
+        ],
+        default=repr,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def count_tokens(text: str) -> int:
+    global _encoding
+    if tiktoken is None:
+        # ~4 characters per token for english text
+        return len(text) // 4
+    with _encoding_lock:
+        if _encoding is None:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def _count_prompt_tokens(prompt) -> int:
+    if isinstance(prompt, str):
+        return count_tokens(prompt)
+    # a list of messages
+    return sum(count_tokens(m.content) for m in prompt)
+
 
+def _split_by_tokens(text: str, max_tokens: int) -> List[str]:
+    """
+    Splits `text` into chunks of at most ~`max_tokens`, on line boundaries where possible.
+    """
+    chunks = []
+    lines = []
+    num_tokens = 0
+    for line in text.splitlines(keepends=True):
+        line_tokens = count_tokens(line)
+        if line_tokens > max_tokens:
+            # a huge line (e.g. a transcript) - cut it by characters instead
+            step = max(len(line) * max_tokens // line_tokens, 1)
+            pieces = [line[i : i + step] for i in range(0, len(line), step)]
+        else:
+            pieces = [line]
+        for piece in pieces:
+            piece_tokens = line_tokens if len(pieces) == 1 else count_tokens(piece)
+            if num_tokens + piece_tokens > max_tokens and len(lines) > 0:
+                chunks.append("".join(lines))
+                lines = []
+                num_tokens = 0
+            lines.append(piece)
+            num_tokens += piece_tokens
+    if len(lines) > 0:
+        chunks.append("".join(lines))
+    return chunks
+
+
+def _summarize_chunk(title: str, i: int, num: int, chunk: str) -> str:
+    result = _call_llm(
+        f"""[begin Article '{title}' part {i + 1} of {num}]
+{chunk}
+[end Article '{title}' part {i + 1} of {num}]
+
+Generate a concise bulleted list of the main points in the above part of the Article.
+Here is the bulleted list:""",
+        kind="summarize_post",
+    )
+    return result.content
+
+
+@metrics.timed("lm.summarize_post")
+def summarize_post(title: str, content: str, on_partial=None) -> str:
+    """
+    `on_partial` streams the summary, see `_call_llm`. Long content is only streamed
+    once its chunk summaries are done, while the final summary is written.
+    """
+    if count_tokens(content) > SUMMARY_TOKEN_BUDGET:
+        # map: summarize each chunk concurrently, reduce: summarize the summaries below
+        chunks = _split_by_tokens(content, SUMMARY_CHUNK_TOKENS)
+        with ThreadPoolExecutor(SUMMARY_CONCURRENCY) as pool:
+            futures = [
+                pool.submit(
+                    contextvars.copy_context().run,
+                    _summarize_chunk,
+                    title,
+                    i,
+                    len(chunks),
+                    chunk,
+                )
+                for i, chunk in enumerate(chunks)
+            ]
+            partials = [future.result() for future in futures]
+        return summarize_post(title, "\n\n".join(partials), on_partial=on_partial)
 
-def summarize_post(title: str, content: str) -> str:
     prompt = f"""[begin Article]
 {title}
 
@@ -43,11 +455,12 @@ Here is the bulleted list summary:"""
     
     
 
-    result = _call_llm(prompt)
+    result = _call_llm(prompt, kind="summarize_post", on_partial=on_partial)
     return result.content
 
 
-def summarize_abstract(title: str, content: str) -> str:
+@metrics.timed("lm.summarize_abstract")
+def summarize_abstract(title: str, content: str, on_partial=None) -> str:
     result = _call_llm(
         f"""[begin Abstract]
 {title}
@@ -69,11 +482,14 @@ The format of the summary must look like the following:
 ```
 
 Here is the summary:
-"""
+""",
+        kind="summarize_abstract",
+        on_partial=on_partial,
     )
     return result.content
 
 
+@metrics.timed("lm.summarize_comment")
 def summarize_comment(title: str, summary: str, comment: str) -> str:
     result = _call_llm(
         f"""[begin Article]
@@ -87,11 +503,77 @@ def summarize_comment(title: str, summary: str, comment: str) -> str:
 [end Comment]
 
 Write an extremely short (less than 5 words; no need for grammatically correct) info bite summarizing the Comment:
-"""
+""",
+        kind="summarize_comment",
     )
     return result.content
 
 
+@metrics.timed("lm.chat")
+def chat(
+    messages,
+    kind="chat",
+    model="gpt-3.5-turbo-16k",
+    temperature=0.7,
+    on_partial=None,
+) -> str:
+    """
+    A free form reply to a list of messages, e.g. an answer to a question in a thread.
+    These are sampled, so they are never cached. `on_partial` streams the reply,
+    see `_call_llm`.
+    """
+    # thread answers have always come from OpenAI, whatever LLM_BACKEND is
+    return _call_llm(
+        messages,
+        model=model,
+        temperature=temperature,
+        kind=kind,
+        backend="openai",
+        on_partial=on_partial,
+    ).content
+
+
+@metrics.timed("lm.extract_from_section")
+def extract_from_section(
+    section_name: str,
+    section: str,
+    question: str,
+    model="gpt-3.5-turbo-16k",
+    backend=None,
+) -> dict:
+    """
+    Returns a dictionary with a "summary" of the information in `section` that is
+    relevant to `question`, and whether there was any ("relevant").
+    Unparseable responses count as not relevant.
+    """
+    result = _call_llm(
+        f"""[begin Section '{section_name}']
+{section}
+[end Section '{section_name}']
+
+[begin Question]
+{question}
+[end Question]
+
+Extract information from Section '{section_name}' that is relevant to the Question. The output should be a JSON dictionary with two keys. The first key should be the summary, and the second key should be a boolean value indicating whether there is useful information in the section. Here is an example output:
+{{"summary": "<example summary text...>", "relevant": false}}
+""",
+        model=model,
+        kind="extract_from_section",
+        backend=backend,
+    )
+    match = re.search(r"\{.*\}", result.content, re.DOTALL)
+    try:
+        extraction = json.loads(match.group(0))
+        return {
+            "summary": str(extraction["summary"]),
+            "relevant": extraction["relevant"] is True,
+        }
+    except (AttributeError, json.JSONDecodeError, KeyError, TypeError):
+        return {"summary": result.content, "relevant": False}
+
+
+@metrics.timed("lm.matches_filter")
 def matches_filter(content: str, filter: str) -> bool:
     result = _call_llm(
         f"""[begin Article]
@@ -105,7 +587,85 @@ We are looking for Articles that match the following Filter
 
 Does the above Article match the above Filter? The Answer should be Yes or No:
 **Answer**:
-"""
+""",
+        kind="matches_filter",
     )
     content = result.content.strip().lower()
     return content == "yes" or content not in ["yes", "no"]
+
+
+@metrics.timed("lm.matches_filter_batch")
+def matches_filter_batch(contents: List[str], filter: str) -> List[bool]:
+    """
+    Same as `matches_filter`, but classifies all of `contents` with a single prompt.
+    Batches that are too big for the model context are split in half, and any Article
+    whose answer can't be parsed falls back to an individual `matches_filter` call.
+    """
+    if len(contents) == 0:
+        return []
+    if len(contents) == 1:
+        return [matches_filter(contents[0], filter)]
+
+    articles = "\n\n".join(
+        f"[begin Article {i + 1}]\n{content}\n[end Article {i + 1}]"
+        for i, content in enumerate(contents)
+    )
+    prompt = f"""{articles}
+
+We are looking for Articles that match the following Filter
+[begin Filter]
+{filter}
+[end Filter]
+
+For each of the above Articles, does it match the above Filter? The output should be a JSON dictionary mapping each Article number to an Answer of Yes or No. Here is an example output for 3 Articles:
+{{"1": "No", "2": "Yes", "3": "No"}}
+**Answer**:
+"""
+    if count_tokens(prompt) > BATCH_TOKEN_BUDGET:
+        return _split_batch(contents, filter)
+
+    try:
+        result = _call_llm(prompt, kind="matches_filter_batch")
+    except InvalidRequestError as err:
+        if err.code == "context_length_exceeded":
+            return _split_batch(contents, filter)
+        raise
+
+    answers = _parse_batch_answers(result.content, len(contents))
+    return [
+        matches_filter(content, filter) if answer is None else answer
+        for content, answer in zip(contents, answers)
+    ]
+
+
+def _split_batch(contents: List[str], filter: str) -> List[bool]:
+    mid = len(contents) // 2
+    return matches_filter_batch(contents[:mid], filter) + matches_filter_batch(
+        contents[mid:], filter
+    )
+
+
+def _parse_batch_answers(text: str, num: int):
+    """
+    Returns a list of `num` booleans, with None for any Article we couldn't find an answer for.
+    """
+    match = re.search(r"\{.*\}", text, re.DOTALL)
+    if match is None:
+        return [None] * num
+    try:
+        parsed = json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return [None] * num
+    if not isinstance(parsed, dict):
+        return [None] * num
+
+    answers = []
+    for i in range(num):
+        answer = str(parsed.get(str(i + 1), "")).strip().lower()
+        if answer == "yes":
+            answers.append(True)
+        elif answer == "no":
+            answers.append(False)
+        else:
+            answers.append(None)
+    return answers
@@ -0,0 +1,316 @@
+import contextlib
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# where the prometheus /metrics endpoint listens, an empty port disables it
+METRICS_HOST = os.environ.get("NEWSY_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = os.environ.get("NEWSY_METRICS_PORT", "9464")
+LOG_LEVEL = os.environ.get("NEWSY_LOG_LEVEL", "INFO")
+
+# scraped pages come from an unbounded set of hosts, so past this many label sets
+# a metric folds new ones into host="other"
+MAX_SERIES = 2000
+
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+logger = logging.getLogger("newsy")
+
+# the slack command & news source that the current thread is working on. Thread pools
+# run their tasks in a copy of the submitter's context, so nested spans are tagged too.
+_command = contextvars.ContextVar("command", default="")
+_source = contextvars.ContextVar("source", default="")
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name: str, help: str, labels) -> None:
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _get_series(self, labels):
+        # must hold self._lock
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        if key not in self._series and len(self._series) >= MAX_SERIES:
+            labels = dict(labels, host="other")
+            key = tuple(str(labels.get(name, "")) for name in self.labels)
+        if key not in self._series:
+            self._series[key] = self._new_series()
+        return key, self._series[key]
+
+    def _format_labels(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if len(pairs) == 0:
+            return ""
+        escaped = (
+            (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+            for name, value in pairs
+        )
+        return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                lines.extend(self._render_series(key, series))
+        return lines
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_series(self):
+        return [0.0]
+
+    def inc(self, amount=1.0, **labels):
+        with self._lock:
+            _, series = self._get_series(labels)
+            series[0] += amount
+
+    def _render_series(self, key, series):
+        return [f"{self.name}{self._format_labels(key)} {series[0]:g}"]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels, buckets=_BUCKETS) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def _new_series(self):
+        # a count per bucket, then the sum & count of all observations
+        return [0] * len(self.buckets) + [0.0, 0]
+
+    def observe(self, value: float, **labels):
+        with self._lock:
+            _, series = self._get_series(labels)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def _render_series(self, key, series):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, series):
+            cumulative += count
+            labels = self._format_labels(key, [("le", f"{bound:g}")])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = self._format_labels(key, [("le", "+Inf")])
+        lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+        lines.append(f"{self.name}_sum{self._format_labels(key)} {series[-2]:g}")
+        lines.append(f"{self.name}_count{self._format_labels(key)} {series[-1]}")
+        return lines
+
+
+_registry = []
+
+COMMAND_SECONDS = Histogram(
+    "newsy_command_seconds",
+    "Time to handle a slack command.",
+    ("command", "status"),
+)
+SPAN_SECONDS = Histogram(
+    "newsy_span_seconds",
+    "Time spent in each stage of a command.",
+    ("span", "command", "source", "host"),
+)
+SPAN_ERRORS = Counter(
+    "newsy_span_errors_total",
+    "Stages of a command that raised an error.",
+    ("span", "command", "source", "host"),
+)
+
+
+def render() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def current_command() -> str:
+    return _command.get()
+
+
+@contextlib.contextmanager
+def command(name: str):
+    """
+    Tags everything done inside with the slack command `name`, and records its latency.
+    """
+    token = _command.set(name)
+    _log(logging.INFO, "command_started", command=name)
+    status = "ok"
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        COMMAND_SECONDS.observe(seconds, command=name, status=status)
+        _log(
+            logging.INFO,
+            "command_finished",
+            command=name,
+            status=status,
+            seconds=round(seconds, 4),
+        )
+        _command.reset(token)
+
+
+@contextlib.contextmanager
+def span(name: str, source=None, host="", command=None):
+    """
+    Times the stage `name` of the current command. A `source` also applies to the spans
+    nested inside, `command` overrides the current one (e.g. for work on another thread).
+    """
+    token = _source.set(source) if source is not None else None
+    labels = {
+        "span": name,
+        "command": _command.get() if command is None else command,
+        "source": _source.get(),
+        "host": host,
+    }
+    error = False
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        error = True
+        raise
+    finally:
+        _record(labels, time.perf_counter() - start, error)
+        if token is not None:
+            _source.reset(token)
+
+
+def timed(name: str, source=None):
+    """
+    Decorator version of `span`. For generator functions, only the time spent producing
+    items is counted (not the time the caller spends on them), as one span.
+    """
+
+    def decorator(fn):
+        if not inspect.isgeneratorfunction(fn):
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with span(name, source=source):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        @functools.wraps(fn)
+        def generator_wrapper(*args, **kwargs):
+            labels = {
+                "span": name,
+                "command": _command.get(),
+                "source": _source.get() if source is None else source,
+                "host": "",
+            }
+            gen = fn(*args, **kwargs)
+            seconds = 0.0
+            error = False
+            try:
+                while True:
+                    token = _source.set(labels["source"])
+                    start = time.perf_counter()
+                    try:
+                        item = next(gen)
+                    except StopIteration:
+                        break
+                    except Exception:
+                        error = True
+                        raise
+                    finally:
+                        seconds += time.perf_counter() - start
+                        _source.reset(token)
+                    yield item
+            finally:
+                gen.close()
+                _record(labels, seconds, error)
+
+        return generator_wrapper
+
+    return decorator
+
+
+def _record(labels, seconds, error):
+    SPAN_SECONDS.observe(seconds, **labels)
+    if error:
+        SPAN_ERRORS.inc(**labels)
+    _log(logging.DEBUG, "span", seconds=round(seconds, 4), error=error, **labels)
+
+
+def _log(level, event, **fields):
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One json object per line, with the fields passed as `extra={"fields": ...}`.
+    """
+
+    def format(self, record):
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "event": record.getMessage(),
+        }
+        data.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data)
+
+
+def configure_logging(level=LOG_LEVEL):
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(host=METRICS_HOST, port=METRICS_PORT):
+    """
+    Serves the metrics on http://host:port/metrics from a background thread.
+    """
+    if str(port).strip() == "":
+        return None
+    server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -1,42 +1,259 @@
 import arxiv
 from datetime import datetime, timedelta
+import hashlib
+import json
 import os
+import re
+import threading
+import time
+
+from . import metrics
+from .cache import CACHE_DIR, DiskCache
+from .parse_pdf import ParsedPdf
+from .util import request
+
+ARXIV_STORE_DIR = os.path.join(CACHE_DIR, "arxiv")
+ARXIV_STORE_MAX_BYTES = int(os.environ.get("NEWSY_ARXIV_STORE_MAX_BYTES", 2**30))
+
+# unversioned urls point at the latest version of a paper, so re-download those after a while.
+# a stored file's mtime is when it was downloaded (for this ttl), its atime when it was last
+# used (for LRU eviction).
+_LATEST_VERSION_TTL = 24 * 60 * 60
+
+_store_locks = {}
+_store_locks_lock = threading.Lock()
+
+_client = None
+_client_lock = threading.RLock()
+_metadata = DiskCache("arxiv_metadata", max_bytes=64 * 2**20)
+
+# papers seen by earlier crawls of each category, and their verdicts for each filter
+_index = DiskCache("arxiv_index", max_bytes=64 * 2**20)
 
 
 def get_item(url: str):
     assert "arxiv.org" in url
+    item = get_items([url])[0]
+    if item is None:
+        raise ValueError(f"No arxiv paper found for {url}")
+    return item
+
+
+@metrics.timed("parse_arxiv.get_items", source="arxiv")
+def get_items(urls):
+    """
+    Looks up the metadata of several papers at once. Papers that aren't cached yet are
+    resolved with a single arxiv api query. Returns None for any paper that doesn't exist.
+    """
+    ids = [_parse_id(url) for url in urls]
+
+    items = {}
+    missing = []
+    for arxiv_id, version in ids:
+        key = arxiv_id + version
+        if key in items or key in missing:
+            continue
+        cached = _metadata.get(key, max_age=None if version else _LATEST_VERSION_TTL)
+        if cached is not None:
+            items[key] = cached[0]
+        else:
+            missing.append(key)
+
+    if len(missing) > 0:
+        search = arxiv.Search(id_list=missing, max_results=len(missing))
+        for result in _iter_results(search):
+            item = _to_item(result)
+            arxiv_id, version = _parse_id(result.entry_id)
+            # results always name a version, but may have been asked for without one
+            _metadata.set(arxiv_id + version, item)
+            items[arxiv_id + version] = item
+            if arxiv_id in missing:
+                _metadata.set(arxiv_id, item)
+                items[arxiv_id] = item
+
+    return [items.get(arxiv_id + version) for arxiv_id, version in ids]
 
-    client = arxiv.Client()
-    search = arxiv.Search(id_list=[url.split("/")[-1].replace(".pdf", "")])
-    item = next(client.results(search))
 
+def _get_client() -> arxiv.Client:
+    """
+    One client for the whole process - it spaces out its requests by `delay_seconds`,
+    which is how arxiv asks to be crawled.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = arxiv.Client(delay_seconds=3.0)
+        return _client
+
+
+def _iter_results(search: arxiv.Search):
+    """
+    Yields the results of `search` from the shared client. The client fetches a page at
+    a time (and waits out its delay first) while holding `_client_lock`, so concurrent
+    searches never send requests faster than the client allows.
+    """
+    results = _get_client().results(search)
+    while True:
+        with _client_lock:
+            result = next(results, None)
+        if result is None:
+            return
+        yield result
+
+
+def _to_item(result: arxiv.Result):
     return {
         "source": "arxiv",
-        "title": item.title,
-        "url": item.entry_id,
-        "authors": [str(a) for a in item.authors],
-        "abstract": item.summary,
-        "category": item.primary_category,
-        "pdf_url": item.pdf_url,
+        "title": result.title,
+        "url": result.entry_id,
+        "authors": [str(a) for a in result.authors],
+        "abstract": result.summary,
+        "category": result.primary_category,
+        "pdf_url": result.pdf_url,
     }
 
 
-def download_pdf(url: str, dir: str = "/tmp"):
-    assert "arxiv.org" in url
+@metrics.timed("parse_arxiv.download_pdf", source="arxiv")
+def download_pdf(url: str) -> str:
+    """
+    Returns the path of the pdf for `url` in the local paper store, downloading it
+    if it isn't there yet. Concurrent calls for the same paper share one download.
+    """
+    arxiv_id, version = _parse_id(url)
+    key = _store_key(arxiv_id, version)
+    path = os.path.join(ARXIV_STORE_DIR, f"{key}.pdf")
+    with _store_lock(key):
+        if not _is_fresh(path, version):
+            os.makedirs(ARXIV_STORE_DIR, exist_ok=True)
+            response = request("GET", f"https://arxiv.org/pdf/{arxiv_id}{version}")
+            response.raise_for_status()
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as fp:
+                fp.write(response.content)
+            os.replace(tmp_path, path)
+
+            # any sections we parsed were for the old file
+            sections_path = os.path.join(ARXIV_STORE_DIR, f"{key}.sections.json")
+            if os.path.exists(sections_path):
+                os.remove(sections_path)
+
+            _evict(keep=key)
+        _touch(path)
+    return path
+
+
+@metrics.timed("parse_arxiv.get_parsed_pdf", source="arxiv")
+def get_parsed_pdf(url: str) -> ParsedPdf:
+    """
+    Same as `ParsedPdf(download_pdf(url))`, except the parsed sections are stored
+    next to the pdf so that a paper is only ever parsed once.
+    """
+    arxiv_id, version = _parse_id(url)
+    key = _store_key(arxiv_id, version)
+    sections_path = os.path.join(ARXIV_STORE_DIR, f"{key}.sections.json")
+    with _store_lock(key):
+        path = download_pdf(url)
+        if os.path.exists(sections_path):
+            with open(sections_path) as fp:
+                pdf = ParsedPdf.from_dict(json.load(fp))
+        else:
+            pdf = ParsedPdf(path)
+            tmp_path = f"{sections_path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as fp:
+                json.dump(pdf.to_dict(), fp)
+            os.replace(tmp_path, sections_path)
+        _touch(sections_path)
+    return pdf
+
+
+def _parse_id(url: str):
+    """
+    Returns `(id, version)` for urls like https://arxiv.org/abs/2310.06825v2, where version
+    is the empty string when the url doesn't pin one.
+    """
+    match = re.search(r"arxiv\.org/(?:abs|pdf)/(.+?)(?:\.pdf)?/?$", url)
+    if match is not None:
+        arxiv_id = match.group(1)
+    else:
+        arxiv_id = url.split("/")[-1].replace(".pdf", "")
+    match = re.fullmatch(r"(.+?)(v\d+)?", arxiv_id)
+    return match.group(1), match.group(2) or ""
+
+
+def _store_key(arxiv_id: str, version: str) -> str:
+    # old style ids look like hep-th/9901001
+    return arxiv_id.replace("/", "_") + version
+
+
+def _store_lock(key: str) -> threading.RLock:
+    with _store_locks_lock:
+        if key not in _store_locks:
+            _store_locks[key] = threading.RLock()
+        return _store_locks[key]
+
+
+def _is_fresh(path: str, version: str) -> bool:
+    if not os.path.exists(path):
+        return False
+    if version != "":
+        # a specific version of a paper never changes
+        return True
+    return time.time() - os.path.getmtime(path) < _LATEST_VERSION_TTL
+
+
+def _touch(path: str):
+    # marks `path` as used without changing when it was written
+    os.utime(path, (time.time(), os.path.getmtime(path)))
+
+
+def _evict(keep: str):
+    """
+    Removes the least recently used papers until the store fits in `ARXIV_STORE_MAX_BYTES`.
+    Papers that another thread is downloading or reading right now are left alone.
+    """
+    papers = {}
+    for name in os.listdir(ARXIV_STORE_DIR):
+        if name.endswith(".pdf"):
+            key = name[: -len(".pdf")]
+        elif name.endswith(".sections.json"):
+            key = name[: -len(".sections.json")]
+        else:
+            continue
+        try:
+            stat = os.stat(os.path.join(ARXIV_STORE_DIR, name))
+        except FileNotFoundError:
+            # evicted by another download in the meantime
+            continue
+        size, last_used = papers.get(key, (0, 0))
+        papers[key] = (size + stat.st_size, max(last_used, stat.st_atime))
 
-    client = arxiv.Client()
-    search = arxiv.Search(id_list=[url.split("/")[-1].replace(".pdf", "")])
-    item = next(client.results(search))
-    filename = item._get_default_filename()
-    full_path = os.path.join(dir, filename)
-    if not os.path.exists(full_path):
-        path = item.download_pdf(dirpath=dir, filename=filename)
-        assert path == full_path
-    return full_path
+    total = sum(size for size, _ in papers.values())
+    for key, (size, _) in sorted(papers.items(), key=lambda kv: kv[1][1]):
+        if total <= ARXIV_STORE_MAX_BYTES:
+            break
+        if key == keep:
+            continue
+        lock = _store_lock(key)
+        if not lock.acquire(blocking=False):
+            continue
+        try:
+            for suffix in (".pdf", ".sections.json"):
+                path = os.path.join(ARXIV_STORE_DIR, key + suffix)
+                if os.path.exists(path):
+                    os.remove(path)
+        finally:
+            lock.release()
+        total -= size
 
 
+@metrics.timed("parse_arxiv.iter_todays_papers", source="arxiv")
 def iter_todays_papers(category: str):
-    client = arxiv.Client()
+    """
+    Yields the papers submitted to `category` recently, newest first.
+
+    Papers found by earlier crawls are kept in a local index, so the crawl stops at the first
+    paper it already knows and the rest are served from the index.
+    """
     search = arxiv.Search(
         query=f"cat:{category}", sort_by=arxiv.SortCriterion.SubmittedDate
     )
@@ -49,17 +266,45 @@ def iter_todays_papers(category: str):
     else:
         delta = timedelta(days=2)
 
-    for item in client.results(search):
+    cached = _index.get(f"papers:{category}")
+    known = [] if cached is None else cached[0]
+    known_urls = set(paper["url"] for paper in known)
+
+    new = []
+    for item in _iter_results(search):
         # only include papers from the last day
         if (today - item.published.date()) >= delta:
             break
+        if item.entry_id in known_urls:
+            break
+
+        paper = _to_item(item)
+        paper["published"] = item.published.isoformat()
+        new.append(paper)
+        yield paper
+
+    # only reached when the crawl finished, so the index never has gaps in it
+    known = [
+        paper
+        for paper in known
+        if (today - datetime.fromisoformat(paper["published"]).date()) < delta
+    ]
+    _index.set(f"papers:{category}", new + known)
+    yield from known
+
+
+def get_verdict(paper, filter: str):
+    """
+    Whether `paper` matched `filter` the last time it was checked, or None if it hasn't been.
+    """
+    cached = _index.get(_verdict_key(paper, filter))
+    return None if cached is None else cached[0]
+
+
+def set_verdict(paper, filter: str, verdict: bool):
+    _index.set(_verdict_key(paper, filter), verdict)
+
 
-        yield {
-            "source": "arxiv",
-            "title": item.title,
-            "url": item.entry_id,
-            "authors": [str(a) for a in item.authors],
-            "abstract": item.summary,
-            "category": item.primary_category,
-            "pdf_url": item.pdf_url,
-        }
+def _verdict_key(paper, filter: str):
+    filter_hash = hashlib.sha256(filter.strip().encode()).hexdigest()
+    return f"verdict:{filter_hash}:{paper['url']}"
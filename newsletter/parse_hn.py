@@ -1,8 +1,14 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+
+from . import metrics
 from .util import get_json_from_url, get_text_from_url
 
 _BASE_URL = "https://hacker-news.firebaseio.com/v0"
 
 
+@metrics.timed("parse_hn.search_for_url", source="hackernews")
 def search_for_url(url: str, num_comments=3):
     response = get_json_from_url(
         f"http://hn.algolia.com/api/v1/search?query={url}&restrictSearchableAttributes=url"
@@ -39,6 +45,7 @@ def search_for_url(url: str, num_comments=3):
     }
 
 
+@metrics.timed("parse_hn.get_item", source="hackernews")
 def get_item(url: str, num_comments=3):
     """
     Parses a url like https://news.ycombinator.com/item?id=38064287
@@ -77,49 +84,120 @@ def get_item(url: str, num_comments=3):
     }
 
 
-def iter_top_posts(num_posts=25, num_comments=3):
-    top_ids = get_json_from_url(f"{_BASE_URL}/topstories.json")
-    for item_id in top_ids[:num_posts]:
-        item = get_json_from_url(f"{_BASE_URL}/item/{item_id}.json")
-        if item["type"] != "story":
-            continue
+@metrics.timed("parse_hn.iter_top_posts", source="hackernews")
+def iter_top_posts(num_posts=25, num_comments=3, max_workers=16, timeout=None):
+    """
+    Fetches the top posts (and their articles & comments) concurrently, but still
+    yields them in rank order, each one as soon as it and every post above it are ready.
 
-        comments_url = f"https://news.ycombinator.com/item?id={item_id}"
-        if "url" in item:
+    `timeout` is an overall deadline in seconds - any post that isn't ready
+    by then is yielded with an "error" instead.
+    """
+    top_ids = get_json_from_url(f"{_BASE_URL}/topstories.json")[:num_posts]
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    # two pools so that post workers can block on their article/comment fetches
+    # without starving those fetches of threads.
+    posts_pool = ThreadPoolExecutor(max_workers)
+    fetch_pool = ThreadPoolExecutor(max_workers)
+    try:
+        futures = [
+            posts_pool.submit(
+                contextvars.copy_context().run,
+                _get_top_post,
+                fetch_pool,
+                item_id,
+                num_comments,
+            )
+            for item_id in top_ids
+        ]
+        for item_id, future in zip(top_ids, futures):
+            comments_url = f"https://news.ycombinator.com/item?id={item_id}"
+            if deadline is None:
+                remaining = None
+            else:
+                remaining = max(0.0, deadline - time.monotonic())
             try:
-                content = get_text_from_url(item["url"])
+                post = future.result(timeout=remaining)
+            except FuturesTimeoutError:
+                post = {
+                    "source": "HackerNews",
+                    "error": TimeoutError(f"Deadline of {timeout}s exceeded"),
+                    "content_url": comments_url,
+                    "comments_url": comments_url,
+                }
             except Exception as err:
-                yield {
+                post = {
                     "source": "HackerNews",
                     "error": err,
-                    "title": item["title"],
-                    "score": item["score"],
-                    "content_url": item.get("url", comments_url),
+                    "content_url": comments_url,
                     "comments_url": comments_url,
                 }
-                continue
-        else:
-            content = item["text"]
-
-        comments = []
-        if "kids" in item:
-            for comment_id in item["kids"][:num_comments]:
-                c = get_json_from_url(f"{_BASE_URL}/item/{comment_id}.json")
-                if c is None or "text" not in c:
-                    # deleted comment
-                    continue
-                comments.append(
-                    {
-                        "content": c["text"],
-                        "url": f"https://news.ycombinator.com/item?id={comment_id}",
-                    }
-                )
-        yield {
-            "source": "HackerNews",
-            "title": item["title"],
-            "score": item["score"],
-            "content_url": item.get("url", comments_url),
-            "comments_url": comments_url,
-            "content": content,
-            "comments": comments,
-        }
+            if post is not None:
+                yield post
+    finally:
+        posts_pool.shutdown(wait=False, cancel_futures=True)
+        fetch_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _get_top_post(fetch_pool: ThreadPoolExecutor, item_id, num_comments):
+    item = get_json_from_url(f"{_BASE_URL}/item/{item_id}.json")
+    if item["type"] != "story":
+        return None
+
+    comments_url = f"https://news.ycombinator.com/item?id={item_id}"
+
+    # kick off the article scrape & the comment fetches all at once
+    content_future = None
+    if "url" in item:
+        content_future = fetch_pool.submit(
+            contextvars.copy_context().run, get_text_from_url, item["url"]
+        )
+    comment_ids = item.get("kids", [])[:num_comments]
+    comment_futures = [
+        fetch_pool.submit(
+            contextvars.copy_context().run,
+            get_json_from_url,
+            f"{_BASE_URL}/item/{comment_id}.json",
+        )
+        for comment_id in comment_ids
+    ]
+
+    if content_future is not None:
+        try:
+            content = content_future.result()
+        except Exception as err:
+            for f in comment_futures:
+                f.cancel()
+            return {
+                "source": "HackerNews",
+                "error": err,
+                "title": item["title"],
+                "score": item["score"],
+                "content_url": item.get("url", comments_url),
+                "comments_url": comments_url,
+            }
+    else:
+        content = item["text"]
+
+    comments = []
+    for comment_id, future in zip(comment_ids, comment_futures):
+        c = future.result()
+        if c is None or "text" not in c:
+            # deleted comment
+            continue
+        comments.append(
+            {
+                "content": c["text"],
+                "url": f"https://news.ycombinator.com/item?id={comment_id}",
+            }
+        )
+    return {
+        "source": "HackerNews",
+        "title": item["title"],
+        "score": item["score"],
+        "content_url": item.get("url", comments_url),
+        "comments_url": comments_url,
+        "content": content,
+        "comments": comments,
+    }
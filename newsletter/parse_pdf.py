@@ -1,5 +1,7 @@
+import io
 import os
-from pdfminer.high_level import extract_pages, extract_text
+import pdfminer.high_level
+from pdfminer.high_level import extract_pages
 from pdfminer.layout import LTTextContainer, LTChar, LTTextLine
 
 
@@ -25,21 +27,42 @@ class ParsedPdf:
 
         header_font_size = None
         self.section_names = []
+        self.page_texts = []
         self._section_start_pages = []
+        self._section_paragraphs = []
 
+        # this is the only layout analysis we do - the text of every page & section
+        # is captured along the way, so get_section never has to re-parse the pdf.
+        reached_references = False
         for i_page, page in enumerate(extract_pages(os.path.expanduser(path))):
+            page_paragraphs = []
             for paragraph in page:
-                if isinstance(paragraph, LTTextContainer):
-                    font_size = _get_font_size(paragraph)
-                    if "Introduction" in paragraph.get_text():
-                        header_font_size = font_size
-
-                    if (
-                        header_font_size is not None
-                        and abs(font_size - header_font_size) < 1e-3
-                    ):
-                        self.section_names.append(paragraph.get_text().strip())
-                        self._section_start_pages.append(i_page)
+                if not isinstance(paragraph, LTTextContainer):
+                    continue
+                text = paragraph.get_text()
+                font_size = _get_font_size(paragraph)
+                if "Introduction" in text:
+                    header_font_size = font_size
+
+                if (
+                    header_font_size is not None
+                    and abs(font_size - header_font_size) < 1e-3
+                ):
+                    name = text.strip()
+                    if _is_references(name):
+                        # nothing after the references is used, so stop analyzing here
+                        reached_references = True
+                        break
+                    self.section_names.append(name)
+                    self._section_start_pages.append(i_page)
+                    self._section_paragraphs.append([])
+
+                page_paragraphs.append(text)
+                if len(self._section_paragraphs) > 0:
+                    self._section_paragraphs[-1].append(text)
+            self.page_texts.append("".join(page_paragraphs))
+            if reached_references:
+                break
         self.num_pages = i_page + 1
 
         if header_font_size is None:
@@ -62,28 +85,55 @@ class ParsedPdf:
             del self.section_names[: i_abstract + 1]
             del self._section_start_pages[: i_abstract + 1]
             del self._section_end_pages[: i_abstract + 1]
-
-        # Deleting references and everything after
-        i_citations = None
-        for i, name in enumerate(self.section_names):
-            if "Reference" in name or "Citation" in name:
-                i_citations = i
-                break
-        if i_citations is not None:
-            del self.section_names[i_citations:]
-            del self._section_start_pages[i_citations:]
-            del self._section_end_pages[i_citations:]
+            del self._section_paragraphs[: i_abstract + 1]
 
         if len(self._section_start_pages) != len(self._section_end_pages):
             raise SectionParsingError("Unable to parse sections of the pdf properly.")
 
+    def to_dict(self):
+        return {
+            "path": self.path,
+            "num_pages": self.num_pages,
+            "page_texts": self.page_texts,
+            "section_names": self.section_names,
+            "section_start_pages": self._section_start_pages,
+            "section_end_pages": self._section_end_pages,
+            "section_paragraphs": self._section_paragraphs,
+        }
+
+    @classmethod
+    def from_dict(cls, data) -> "ParsedPdf":
+        """
+        Restores a ParsedPdf from `to_dict()` without re-parsing the pdf.
+        """
+        pdf = cls.__new__(cls)
+        pdf.path = data["path"]
+        pdf.num_pages = data["num_pages"]
+        pdf.page_texts = data["page_texts"]
+        pdf.section_names = data["section_names"]
+        pdf._section_start_pages = data["section_start_pages"]
+        pdf._section_end_pages = data["section_end_pages"]
+        pdf._section_paragraphs = data["section_paragraphs"]
+        return pdf
+
     def get_section(self, name):
         assert name in self.section_names
         i = self.section_names.index(name)
-        start_page = self._section_start_pages[i]
-        end_page = self._section_end_pages[i]
-        content = extract_text(
-            self.path, page_numbers=list(range(start_page, end_page + 1))
-        )
+        content = "".join(self._section_paragraphs[i])
         assert name in content
         return content
+
+
+def _is_references(section_name: str) -> bool:
+    return "Reference" in section_name or "Citation" in section_name
+
+
+def extract_text(data: bytes, max_pages=50):
+    """
+    Plain text of the first `max_pages` pages of the pdf in `data`, for pdfs linked to
+    directly (which have no sections we know how to find). The first line is used as the title.
+    """
+    text = pdfminer.high_level.extract_text(io.BytesIO(data), maxpages=max_pages)
+    lines = [line.strip() for line in text.splitlines() if line.strip() != ""]
+    title = lines[0] if len(lines) > 0 else ""
+    return {"title": title, "text": text.strip()}
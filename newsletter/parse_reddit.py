@@ -1,34 +1,70 @@
 from praw import Reddit
-from praw.models import Submission
+from praw.models import Comment, Submission
 import os
+import threading
 
+from . import metrics
 from .util import get_text_from_url
 
+_reddit = None
+_reddit_lock = threading.Lock()
+
+
+def _get_reddit() -> Reddit:
+    """
+    One client for the whole process, so its OAuth token is reused between calls.
+    """
+    global _reddit
+    with _reddit_lock:
+        if _reddit is None:
+            _reddit = Reddit(
+                client_id=os.environ["REDDIT_CLIENT_ID"],
+                client_secret=os.environ["REDDIT_CLIENT_SECRET"],
+                password=os.environ["REDDIT_PASSWORD"],
+                username=os.environ["REDDIT_USERNAME"],
+                user_agent="USERAGENT",
+            )
+        return _reddit
+
+
+def _get_submission_with_comments(
+    reddit: Reddit, submission_id: str, num_comments, depth=1
+):
+    """
+    Fetches a submission along with only its `num_comments` top comments (up to `depth` levels deep),
+    instead of the whole comment forest that `Submission.comments` loads.
+    """
+    submission_listing, comment_listing = reddit.get(
+        f"/comments/{submission_id}",
+        params={"limit": num_comments, "depth": depth, "sort": "top"},
+    )
+
+    comments = []
+    for comment in comment_listing.children:
+        if len(comments) >= num_comments:
+            break
+        if not isinstance(comment, Comment):
+            # a "load more comments" stub
+            continue
+        comments.append(
+            {
+                "content": comment.body,
+                "url": "https://www.reddit.com" + comment.permalink,
+                "score": comment.score,
+            }
+        )
+    return submission_listing.children[0], comments
+
 
+@metrics.timed("parse_reddit.search_for_url", source="reddit")
 def search_for_url(url: str, num_comments=3):
-    reddit = Reddit(
-        client_id=os.environ["REDDIT_CLIENT_ID"],
-        client_secret=os.environ["REDDIT_CLIENT_SECRET"],
-        password=os.environ["REDDIT_PASSWORD"],
-        username=os.environ["REDDIT_USERNAME"],
-        user_agent="USERAGENT",
-    )
+    reddit = _get_reddit()
 
     for item in reddit.subreddit("all").search(f"url:{url}", limit=25):
         if item.url != url:
             continue
 
-        comments = []
-        for i, comment in enumerate(item.comments):
-            if i >= num_comments:
-                break
-            comments.append(
-                {
-                    "content": comment.body,
-                    "url": "https://www.reddit.com" + comment.permalink,
-                    "score": comment.score,
-                }
-            )
+        _, comments = _get_submission_with_comments(reddit, item.id, num_comments)
 
         return {
             "source": "/r/" + item.subreddit.display_name,
@@ -42,34 +78,19 @@ def search_for_url(url: str, num_comments=3):
     return None
 
 
+@metrics.timed("parse_reddit.get_item", source="reddit")
 def get_item(url: str, num_comments=3):
-    reddit = Reddit(
-        client_id=os.environ["REDDIT_CLIENT_ID"],
-        client_secret=os.environ["REDDIT_CLIENT_SECRET"],
-        password=os.environ["REDDIT_PASSWORD"],
-        username=os.environ["REDDIT_USERNAME"],
-        user_agent="USERAGENT",
-    )
+    reddit = _get_reddit()
 
-    item = Submission(reddit, url=url)
+    item, comments = _get_submission_with_comments(
+        reddit, Submission.id_from_url(url), num_comments
+    )
 
     content = item.selftext
     if len(content) == 0:
         # this was not a selftext
         content = get_text_from_url(item.url)
 
-    comments = []
-    for i, comment in enumerate(item.comments):
-        if i >= num_comments:
-            break
-        comments.append(
-            {
-                "content": comment.body,
-                "url": "https://www.reddit.com" + comment.permalink,
-                "score": comment.score,
-            }
-        )
-
     return {
         "source": "/r/" + item.subreddit.display_name,
         "title": item.title,
@@ -81,14 +102,9 @@ def get_item(url: str, num_comments=3):
     }
 
 
+@metrics.timed("parse_reddit.iter_top_posts", source="reddit")
 def iter_top_posts(subreddit, num_posts=25, num_comments=3):
-    reddit = Reddit(
-        client_id=os.environ["REDDIT_CLIENT_ID"],
-        client_secret=os.environ["REDDIT_CLIENT_SECRET"],
-        password=os.environ["REDDIT_PASSWORD"],
-        username=os.environ["REDDIT_USERNAME"],
-        user_agent="USERAGENT",
-    )
+    reddit = _get_reddit()
 
     for item in reddit.subreddit(subreddit).top(time_filter="day", limit=num_posts):
         content = item.selftext
@@ -107,17 +123,7 @@ def iter_top_posts(subreddit, num_posts=25, num_comments=3):
                 }
                 continue
 
-        comments = []
-        for i, comment in enumerate(item.comments):
-            if i >= num_comments:
-                break
-            comments.append(
-                {
-                    "content": comment.body,
-                    "url": "https://www.reddit.com" + comment.permalink,
-                    "score": comment.score,
-                }
-            )
+        _, comments = _get_submission_with_comments(reddit, item.id, num_comments)
 
         yield {
             "source": f"/r/{subreddit}",
@@ -1,35 +1,152 @@
-import bs4
-import requests
-from datetime import datetime, timedelta
+import os
+import xml.etree.ElementTree as ET
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 
-from .util import get_text_from_url
+from . import metrics, pipeline
+from .cache import DiskCache
+from .util import get_text_from_url, request
 
+DEFAULT_FEEDS = [
+    ("OpenAI Blog", "https://openai.com/blog/rss.xml"),
+    ("StabilityAI Blog", "https://stability.ai/news?format=rss"),
+    ("Microsoft Research", "https://www.microsoft.com/en-us/research/feed/"),
+    ("Deepmind Blog", "https://deepmind.google/blog/rss.xml"),
+    ("NVIDIA Blog", "https://feeds.feedburner.com/nvidiablog"),
+]
 
+_MAX_AGE = timedelta(days=2)
+
+# validators & recent items of every feed, so unchanged feeds only cost a 304
+_feed_cache = DiskCache("rss", max_bytes=16 * 2**20)
+
+
+def get_feeds():
+    """
+    The `(name, url)` of the feeds in the Blogs section of `news`. These can be overridden
+    with NEWSY_RSS_FEEDS, formatted as `name|url` pairs separated by semicolons.
+    """
+    feeds = os.environ.get("NEWSY_RSS_FEEDS", "")
+    if feeds.strip() == "":
+        return DEFAULT_FEEDS
+    result = []
+    for feed in feeds.split(";"):
+        if feed.strip() == "":
+            continue
+        name, _, url = (part.strip() for part in feed.partition("|"))
+        if name == "" or url == "":
+            print(
+                f"Skipping malformed NEWSY_RSS_FEEDS entry '{feed}', expected name|url"
+            )
+            continue
+        result.append((name, url))
+    return result
+
+
+class _Item(dict):
+    """
+    A feed item whose "content" is only scraped when someone actually reads it.
+    """
+
+    def __missing__(self, key):
+        if key != "content":
+            raise KeyError(key)
+        self["content"] = get_text_from_url(self["url"])
+        return self["content"]
+
+
+@metrics.timed("parse_rss.iter_items_from_today", source="rss")
 def iter_items_from_today(rss_feed: str):
-    response = requests.get(rss_feed, timeout=5)
-    response.raise_for_status()
-    soup = bs4.BeautifulSoup(response.content, "xml")
-    now = datetime.utcnow()
-    for item in soup.findAll("item"):
+    for item in _get_recent_items(rss_feed):
+        yield _Item(source=rss_feed, url=item["url"], title=item["title"])
+
+
+def iter_items_from_feeds(feeds, max_workers=8):
+    """
+    Fetches all `(name, url)` feeds concurrently, and yields `(name, item)` for their
+    recent items in the order of `feeds`. Feeds that fail are skipped.
+    """
+    for (name, rss_feed), future in pipeline.map_ordered(
+        lambda feed: list(iter_items_from_today(feed[1])), feeds, max_workers
+    ):
         try:
-            pub_date = datetime.strptime(
-                item.pubDate.string, "%a, %d %b %Y %H:%M:%S %z"
-            )
-        except ValueError:
-            pub_date = datetime.strptime(
-                item.pubDate.string, "%a, %d %b %Y %H:%M:%S %Z"
-            )
-        if pub_date.tzinfo is None:
-            delta = now - pub_date
+            items = future.result()
+        except Exception as err:
+            print(f"Error while processing {rss_feed}: {type(err)} {repr(err)}")
+            continue
+        for item in items:
+            yield name, item
+
+
+def _get_recent_items(rss_feed: str):
+    cached = _feed_cache.get(rss_feed)
+    headers = {}
+    if cached is not None:
+        if cached[0]["etag"] is not None:
+            headers["If-None-Match"] = cached[0]["etag"]
+        if cached[0]["last_modified"] is not None:
+            headers["If-Modified-Since"] = cached[0]["last_modified"]
+
+    with request("GET", rss_feed, headers=headers, stream=True) as response:
+        if cached is not None and response.status_code == 304:
+            _feed_cache.touch(rss_feed)
+            items = cached[0]["items"]
         else:
-            delta = now.astimezone(pub_date.tzinfo) - pub_date
-        if delta > timedelta(days=2):
+            response.raise_for_status()
+            response.raw.decode_content = True
+            items = list(_iter_recent_items(response.raw))
+            _feed_cache.set(
+                rss_feed,
+                {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "items": items,
+                },
+            )
+
+    # the cached items may have gotten old since they were stored
+    now = datetime.now(timezone.utc)
+    return [
+        item
+        for item in items
+        if now - datetime.fromisoformat(item["published"]) <= _MAX_AGE
+    ]
+
+
+def _iter_recent_items(stream):
+    """
+    Parses the feed incrementally, and stops at the first item that is too old
+    (feeds list their newest items first).
+    """
+    now = datetime.now(timezone.utc)
+    for _, element in ET.iterparse(stream, events=("end",)):
+        if _local_name(element.tag) != "item":
             continue
 
-        content = get_text_from_url(item.link.string)
+        pub_date = _child_text(element, "pubDate")
+        if pub_date is None:
+            continue
+        pub_date = parsedate_to_datetime(pub_date)
+        if pub_date.tzinfo is None:
+            pub_date = pub_date.replace(tzinfo=timezone.utc)
+        if now - pub_date > _MAX_AGE:
+            break
+
         yield {
-            "source": rss_feed,
-            "url": item.link.string,
-            "title": item.title.string,
-            "content": content,
+            "url": _child_text(element, "link"),
+            "title": _child_text(element, "title"),
+            "published": pub_date.isoformat(),
         }
+        element.clear()
+
+
+def _child_text(element, name):
+    for child in element:
+        if _local_name(child.tag) == name:
+            return (child.text or "").strip()
+    return None
+
+
+def _local_name(tag: str) -> str:
+    # strips the namespace from tags like {http://...}item
+    return tag.rsplit("}", 1)[-1]
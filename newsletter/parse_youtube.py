@@ -1,14 +1,19 @@
-import requests
 from youtube_transcript_api import YouTubeTranscriptApi
 
+from . import metrics
+from .util import request
 
+
+@metrics.timed("parse_youtube.get_item", source="youtube")
 def get_item(url: str):
     assert "youtube.com" in url
     assert "v=" in url
     video_id = url.split("v=")[1]
 
     params = {"format": "json", "url": url}
-    meta = requests.get("https://www.youtube.com/oembed", params=params).json()
+    response = request("GET", "https://www.youtube.com/oembed", params=params)
+    response.raise_for_status()
+    meta = response.json()
 
     parts = YouTubeTranscriptApi.get_transcript(video_id, languages=["en"])
     content = " ".join(p["text"] for p in parts)
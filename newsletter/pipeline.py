@@ -0,0 +1,62 @@
+import contextvars
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+
+def map_ordered(fn, items, max_in_flight=8):
+    """
+    Runs `fn` on every element of `items` using a pool of `max_in_flight` threads.
+    `items` is consumed lazily on the calling thread, so a slow producer (e.g. a crawler)
+    overlaps with the calls to `fn`.
+
+    Yields `(item, future)` pairs in the original order of `items`, each one as soon as
+    its future is done. Call `future.result()` to get the value (or raise the error).
+    `fn` runs in a copy of the caller's context, so its metrics are tagged like the caller's.
+    """
+    pool = ThreadPoolExecutor(max_in_flight)
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(
+                (item, pool.submit(contextvars.copy_context().run, fn, item))
+            )
+            # hand back whatever is already finished (in order) before pulling more
+            # input, and block on the oldest item once we hit the in-flight limit.
+            while pending and (pending[0][1].done() or len(pending) >= max_in_flight):
+                head, future = pending.popleft()
+                wait([future])
+                yield head, future
+
+        while pending:
+            head, future = pending.popleft()
+            wait([future])
+            yield head, future
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def map_ordered_batched(fn, items, batch_size, max_in_flight=8):
+    """
+    Like `map_ordered`, but `fn` is called with lists of up to `batch_size` items and
+    must return a list with one result per item. Still yields one `(item, future)`
+    pair per item, in the original order.
+    """
+    for batch, future in map_ordered(fn, batched(items, batch_size), max_in_flight):
+        for i, item in enumerate(batch):
+            item_future = Future()
+            try:
+                item_future.set_result(future.result()[i])
+            except Exception as err:
+                item_future.set_exception(err)
+            yield item, item_future
+
+
+def batched(items, batch_size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
@@ -0,0 +1,80 @@
+import math
+import re
+from collections import Counter
+from typing import List
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# generic words plus the boilerplate our filter descriptions tend to start with
+_STOPWORDS = frozenset(
+    """a about all an and any anything are as at be by can do for from has have how
+    in into is it its like of on or our over related so such than that the their
+    them these this those to was we were what when which while who will with
+
+    article articles paper papers post posts technique techniques""".split()
+)
+
+
+def bm25_scores(query: str, documents: List[str], k1=1.5, b=0.75) -> List[float]:
+    """
+    Okapi BM25 score of each document against `query`, with idf computed over `documents`.
+    """
+    docs = [Counter(_tokenize(d)) for d in documents]
+    if len(docs) == 0:
+        return []
+    lengths = [sum(d.values()) for d in docs]
+    avg_length = max(sum(lengths) / len(docs), 1)
+
+    terms = set(_tokenize(query))
+    idf = {}
+    for term in terms:
+        df = sum(1 for d in docs if term in d)
+        idf[term] = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+
+    scores = []
+    for doc, length in zip(docs, lengths):
+        score = 0.0
+        for term in terms:
+            tf = doc[term]
+            if tf == 0:
+                continue
+            score += (
+                idf[term]
+                * tf
+                * (k1 + 1)
+                / (tf + k1 * (1 - b + b * length / avg_length))
+            )
+        scores.append(score)
+    return scores
+
+
+def prefilter(items, texts: List[str], query: str, top_k=None, min_score=None):
+    """
+    Cheaply narrows `items` down to the ones worth an LLM call: the `top_k` best scoring
+    by BM25 of `texts` against `query`, plus any scoring at least `min_score`.
+    Items are returned in their original order. With neither limit set, nothing is dropped.
+    """
+    if top_k is None and min_score is None:
+        return list(items)
+
+    scores = bm25_scores(query, texts)
+    keep = set()
+    if top_k is not None:
+        ranked = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+        keep.update(ranked[:top_k])
+    if min_score is not None:
+        keep.update(i for i, score in enumerate(scores) if score >= min_score)
+    return [item for i, item in enumerate(items) if i in keep]
+
+
+def _tokenize(text: str) -> List[str]:
+    return [_stem(t) for t in _TOKEN_RE.findall(text.lower()) if t not in _STOPWORDS]
+
+
+def _stem(token: str) -> str:
+    # just enough to match plurals, e.g. "models" & "model"
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
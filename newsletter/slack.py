@@ -4,6 +4,11 @@ from slack_sdk.models.blocks import SectionBlock
 import os
 import certifi
 import ssl
+import threading
+import time
+import weakref
+
+from . import metrics
 
 
 class SlackChannel:
@@ -43,61 +48,270 @@ class SlackChannel:
         )
 
 
+class _UpdateScheduler:
+    """
+    Sends EditableMessage updates from a background thread. Pending edits of a message
+    are coalesced into its latest state, each message is updated at most once every
+    `min_interval` seconds, and Slack's Retry-After is honored when we get rate limited.
+    """
+
+    def __init__(self, min_interval: float, max_attempts=3) -> None:
+        self.min_interval = min_interval
+        self.max_attempts = max_attempts
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._attempts = {}
+        self._in_flight = set()
+        self._next_send = weakref.WeakKeyDictionary()
+        self._thread = None
+
+    def schedule(self, message: "EditableMessage"):
+        with self._cond:
+            self._pending[message] = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def flush(self, message: "EditableMessage", timeout=None):
+        """
+        Blocks until the latest state of `message` has been sent to slack.
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: message not in self._pending and message not in self._in_flight,
+                timeout=timeout,
+            )
+
+    def _run(self):
+        while True:
+            with self._cond:
+                message = self._next_ready()
+                while message is None:
+                    self._cond.wait(timeout=self._time_until_ready())
+                    message = self._next_ready()
+                del self._pending[message]
+                self._in_flight.add(message)
+
+            delay = self.min_interval
+            failed = False
+            try:
+                # render at send time, so all the edits since the last update go out together
+                text, blocks = message._render()
+                message._update(text, blocks)
+            except Exception as err:
+                # anything, e.g. a connection error - this thread sends every message's updates
+                print(
+                    f"Error while updating slack message {message.thread}: {type(err)} {repr(err)}"
+                )
+                delay = _retry_after(err)
+                if delay is None:
+                    attempt = self._attempts.get(message, 0) + 1
+                    delay = self.min_interval * 2**attempt
+                failed = True
+            finally:
+                with self._cond:
+                    self._in_flight.discard(message)
+                    self._next_send[message] = time.monotonic() + max(
+                        delay, self.min_interval
+                    )
+                    if failed:
+                        self._attempts[message] = self._attempts.get(message, 0) + 1
+                        if self._attempts[message] < self.max_attempts:
+                            self._pending[message] = True
+                        else:
+                            print(
+                                f"Giving up on updating slack message {message.thread}"
+                            )
+                            self._attempts.pop(message)
+                    else:
+                        self._attempts.pop(message, None)
+                    self._cond.notify_all()
+
+    def _next_ready(self):
+        now = time.monotonic()
+        for message in self._pending:
+            if message in self._in_flight:
+                continue
+            if self._next_send.get(message, 0) <= now:
+                return message
+        return None
+
+    def _time_until_ready(self):
+        now = time.monotonic()
+        waits = [
+            self._next_send.get(message, 0) - now
+            for message in self._pending
+            if message not in self._in_flight
+        ]
+        if len(waits) == 0:
+            return None
+        return max(min(waits), 0)
+
+
+def _retry_after(err: Exception):
+    if not isinstance(err, SlackApiError):
+        return None
+    if err.response is None or err.response.status_code != 429:
+        return None
+    headers = {k.lower(): v for k, v in err.response.headers.items()}
+    try:
+        return float(headers.get("retry-after", 1))
+    except (TypeError, ValueError):
+        return None
+
+
+_scheduler = _UpdateScheduler(
+    min_interval=float(os.environ.get("NEWSY_SLACK_UPDATE_INTERVAL", 1.0))
+)
+
+# max seconds EditableMessage.flush waits for slack to catch up
+FLUSH_TIMEOUT = float(os.environ.get("NEWSY_SLACK_FLUSH_TIMEOUT", 30.0))
+
+
 class EditableMessage:
     def __init__(self, client: WebClient, channel: str, msg: str, ts=None):
         self.client = client
         self.channel = channel
-        self.blocks = []
-        self.lines = [msg]
+        self._init_content(msg)
         news = self.client.chat_postMessage(
             text="\n".join(self.lines), channel=self.channel, thread_ts=ts
         )
         self.thread = news.data["ts"]
+        # replies go into the thread this message is in, or start one under it
+        self._reply_ts = ts if ts is not None else self.thread
+
+    def _init_content(self, msg):
+        self._command = metrics.current_command()
+        self.blocks = []
+        self.lines = [msg]
+        # len("\n".join(self.lines)), kept up to date so we never have to join just to measure
+        self._text_len = len(msg)
+        self._progress_msg = None
+        self._lock = threading.Lock()
 
     def start_new_section(self):
-        self.blocks.append(SectionBlock(text="\n".join(self.lines)))
-        self.lines.clear()
+        with self._lock:
+            self._start_new_section()
 
     def lazy_add_line(self, new_line):
-        self.lines.append(new_line)
+        with self._lock:
+            self._append(new_line)
 
     def edit_line(self, new_line):
-        self.lines[-1] = new_line
-        self._update("\n".join(self.lines))
+        with self._lock:
+            self._text_len += len(new_line) - len(self.lines[-1])
+            self.lines[-1] = new_line
+            self._progress_msg = None
+        self._schedule()
+
+    def stream_line(self, prefix=""):
+        """
+        Returns a callback that shows `prefix` followed by the text it's given on the last
+        line, e.g. as the `on_partial` of an lm call. It can be called for every token,
+        slack is still updated at most once every NEWSY_SLACK_UPDATE_INTERVAL seconds.
+        """
+        return lambda partial: self.edit_line(prefix + partial)
 
     def add_line(self, new_line):
-        if len("\n".join(self.lines)) + 1 + len(new_line) >= 3000:
-            self.start_new_section()
-        self.lines.append(new_line)
-        self._update("\n".join(self.lines))
+        with self._lock:
+            if self._text_len + 1 + len(new_line) >= 3000:
+                self._start_new_section()
+            self._append(new_line)
+            self._progress_msg = None
+        self._schedule()
 
     def set_progress_msg(self, msg):
-        if len("\n".join(self.lines)) + 5 + len(msg) >= 3000:
-            self.start_new_section()
-        self._update("\n".join(self.lines) + "\n\n_" + msg + "_\n")
-
-    def _update(self, content):
-        if len(self.blocks) == 0:
-            blocks = None
-            text = content
-        else:
-            blocks = self.blocks + [SectionBlock(text=content)]
-            text = "More news for you!"
-        for _ in range(3):
-            try:
-                self.client.chat_update(
-                    text=text,
-                    blocks=blocks,
-                    channel=self.channel,
-                    unfurl_links=False,
-                    unfurl_media=False,
-                    ts=self.thread,
-                )
-                return
-            except SlackApiError:
-                ...
+        with self._lock:
+            if self._text_len + 5 + len(msg) >= 3000:
+                self._start_new_section()
+            self._progress_msg = msg
+        self._schedule()
+
+    def sections(self):
+        """
+        The text of each section of this message, e.g. to store it & post it again later.
+        """
+        with self._lock:
+            return [b.text.text for b in self.blocks] + ["\n".join(self.lines)]
+
+    def replace(self, sections):
+        """
+        Replaces the whole content of this message with `sections`.
+        """
+        with self._lock:
+            self.blocks = [SectionBlock(text=t) for t in sections[:-1]]
+            self.lines = [sections[-1]]
+            self._text_len = len(sections[-1])
+            self._progress_msg = None
+        self._schedule()
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        """
+        Waits until slack shows the latest state of this message, or `timeout` seconds.
+        """
+        _scheduler.flush(self, timeout=timeout)
+
+    def _schedule(self):
+        _scheduler.schedule(self)
+
+    def _start_new_section(self):
+        self.blocks.append(SectionBlock(text="\n".join(self.lines)))
+        self.lines.clear()
+        self._text_len = 0
+
+    def _append(self, new_line):
+        if len(self.lines) > 0:
+            self._text_len += 1
+        self.lines.append(new_line)
+        self._text_len += len(new_line)
+
+    def _render(self):
+        with self._lock:
+            content = "\n".join(self.lines)
+            if self._progress_msg is not None:
+                content += "\n\n_" + self._progress_msg + "_\n"
+            if len(self.blocks) == 0:
+                return content, None
+            return "More news for you!", self.blocks + [SectionBlock(text=content)]
+
+    def _update(self, text, blocks):
+        # runs on the scheduler thread, so tag it with the command that created the message
+        with metrics.span("slack_update", host="slack.com", command=self._command):
+            self.client.chat_update(
+                text=text,
+                blocks=blocks,
+                channel=self.channel,
+                unfurl_links=False,
+                unfurl_media=False,
+                ts=self.thread,
+            )
 
     def reply(self, msg):
         self.client.chat_postMessage(
             text=msg, channel=self.channel, thread_ts=self.thread
         )
+
+    def editable_reply(self, msg) -> "EditableMessage":
+        """
+        Posts `msg` in the thread of this message, as a message that can be edited later.
+        """
+        return EditableMessage(self.client, self.channel, msg, ts=self._reply_ts)
+
+
+class RecordedMessage(EditableMessage):
+    """
+    An EditableMessage that is never sent to slack, for building a message ahead of time.
+    """
+
+    def __init__(self, msg: str):
+        self.client = None
+        self.channel = None
+        self.thread = None
+        self._init_content(msg)
+
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        ...
+
+    def _schedule(self):
+        ...
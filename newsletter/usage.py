@@ -0,0 +1,161 @@
+import atexit
+import json
+import math
+import os
+import threading
+import time
+
+from . import metrics
+from .cache import CACHE_DIR
+
+# running totals of every LLM call, kept across restarts
+STATS_PATH = os.path.expanduser(
+    os.environ.get("NEWSY_LLM_STATS_PATH", os.path.join(CACHE_DIR, "llm_stats.json"))
+)
+_WRITE_INTERVAL = 10.0
+
+# percentiles are computed over the latest this many (uncached) calls of each kind & model
+_NUM_LATENCIES = 1000
+
+# USD per 1K (prompt, completion) tokens, self-hosted models are free
+PRICES = {
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+    "gpt-4-32k": (0.06, 0.12),
+}
+
+LLM_CALLS = metrics.Counter(
+    "newsy_llm_calls_total",
+    "LLM calls by prompt type, model & outcome.",
+    ("kind", "model", "outcome"),
+)
+LLM_TOKENS = metrics.Counter(
+    "newsy_llm_tokens_total",
+    "LLM tokens used by prompt type & model.",
+    ("kind", "model", "type"),
+)
+LLM_FIRST_TOKEN_SECONDS = metrics.Histogram(
+    "newsy_llm_first_token_seconds",
+    "Time until the first token of a streamed LLM reply.",
+    ("kind", "model"),
+)
+
+_lock = threading.Lock()
+_stats = None
+_last_write = 0.0
+
+
+def record(
+    kind: str,
+    model: str,
+    seconds: float,
+    prompt_tokens=0,
+    completion_tokens=0,
+    cached=False,
+    escalated=False,
+    error=False,
+):
+    """
+    Adds one call to the totals of `kind` (the type of prompt) & `model`.
+    `escalated` means the prompt was too long for the default model.
+    """
+    global _last_write
+    if error:
+        outcome = "error"
+    elif cached:
+        outcome = "cache_hit"
+    else:
+        outcome = "ok"
+    LLM_CALLS.inc(kind=kind, model=model, outcome=outcome)
+    LLM_TOKENS.inc(prompt_tokens, kind=kind, model=model, type="prompt")
+    LLM_TOKENS.inc(completion_tokens, kind=kind, model=model, type="completion")
+
+    prompt_price, completion_price = PRICES.get(model, (0.0, 0.0))
+    with _lock:
+        entry = _get_stats()["calls"].setdefault(f"{kind}|{model}", _new_entry())
+        entry["calls"] += 1
+        entry["cache_hits"] += int(cached)
+        entry["escalations"] += int(escalated)
+        entry["errors"] += int(error)
+        entry["prompt_tokens"] += prompt_tokens
+        entry["completion_tokens"] += completion_tokens
+        entry["cost"] += (
+            prompt_tokens * prompt_price + completion_tokens * completion_price
+        ) / 1000
+        if not cached:
+            entry["latencies"].append(round(seconds, 3))
+            del entry["latencies"][:-_NUM_LATENCIES]
+
+        if time.time() - _last_write > _WRITE_INTERVAL:
+            _save()
+            _last_write = time.time()
+
+
+def summary():
+    """
+    Returns `(since, rows)` where each row holds the totals of one kind & model,
+    plus the p50/p95 latency of its uncached calls.
+    """
+    with _lock:
+        stats = _get_stats()
+        rows = []
+        for key, entry in sorted(stats["calls"].items()):
+            kind, model = key.split("|", 1)
+            latencies = sorted(entry["latencies"])
+            row = {k: v for k, v in entry.items() if k != "latencies"}
+            row.update(
+                kind=kind,
+                model=model,
+                p50=_percentile(latencies, 50),
+                p95=_percentile(latencies, 95),
+            )
+            rows.append(row)
+        return stats["since"], rows
+
+
+def save():
+    with _lock:
+        if _stats is not None:
+            _save()
+
+
+def _new_entry():
+    return {
+        "calls": 0,
+        "cache_hits": 0,
+        "escalations": 0,
+        "errors": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "cost": 0.0,
+        "latencies": [],
+    }
+
+
+def _get_stats():
+    # must hold _lock
+    global _stats
+    if _stats is None:
+        try:
+            with open(STATS_PATH) as fp:
+                _stats = json.load(fp)
+        except (FileNotFoundError, json.JSONDecodeError):
+            _stats = {"since": time.time(), "calls": {}}
+    return _stats
+
+
+def _save():
+    # must hold _lock
+    os.makedirs(os.path.dirname(STATS_PATH), exist_ok=True)
+    tmp_path = f"{STATS_PATH}.tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump(_stats, fp)
+    os.replace(tmp_path, STATS_PATH)
+
+
+def _percentile(values, p):
+    if len(values) == 0:
+        return None
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+atexit.register(save)
@@ -1,13 +1,164 @@
+import codecs
+import os
+import random
+import threading
+import time
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
 import requests
+from requests.adapters import HTTPAdapter
 import bs4
 
+from . import extract, metrics, parse_pdf
+from .cache import DiskCache
+
+# upper bound on simultaneous requests we make to any single host, so that
+# concurrent crawlers don't hammer e.g. the HN firebase api
+MAX_CONNECTIONS_PER_HOST = int(os.environ.get("NEWSY_MAX_CONNECTIONS_PER_HOST", 8))
+
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+# (connect, read) timeout used for every request unless the caller overrides it
+DEFAULT_TIMEOUT = (
+    float(os.environ.get("NEWSY_CONNECT_TIMEOUT", 3.05)),
+    float(os.environ.get("NEWSY_READ_TIMEOUT", 10)),
+)
+MAX_RETRIES = int(os.environ.get("NEWSY_MAX_RETRIES", 3))
+_RETRY_BACKOFF = 0.5
+_RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_session = None
+_session_lock = threading.Lock()
+
+# below this many characters the lxml extraction is assumed to have picked the wrong
+# block, and the whole page is extracted with bs4 instead
+MIN_EXTRACTED_CHARS = int(os.environ.get("NEWSY_MIN_EXTRACTED_CHARS", 200))
+
+# scraped pages are served from disk for this many seconds, after that they are
+# revalidated with a conditional GET.
+PAGE_CACHE_TTL = int(os.environ.get("NEWSY_PAGE_CACHE_TTL", 6 * 60 * 60))
+_page_cache = DiskCache(
+    "pages", max_bytes=int(os.environ.get("NEWSY_PAGE_CACHE_MAX_BYTES", 256 * 2**20))
+)
+
+# html beyond this many bytes is cut off (the article is almost always near the top),
+# pdfs larger than their cap are rejected since a truncated pdf can't be parsed.
+MAX_PAGE_BYTES = int(os.environ.get("NEWSY_MAX_PAGE_BYTES", 5 * 2**20))
+MAX_PDF_BYTES = int(os.environ.get("NEWSY_MAX_PDF_BYTES", 32 * 2**20))
+_CHUNK_SIZE = 64 * 2**10
+
+# content types we never download the body of
+_MEDIA_TYPES = ("image/", "video/", "audio/", "font/")
+_BINARY_TYPES = (
+    "application/zip",
+    "application/gzip",
+    "application/x-tar",
+    "application/x-7z-compressed",
+    "application/vnd.rar",
+    "application/x-rar-compressed",
+    "application/vnd.ms-",
+    "application/vnd.openxmlformats",
+    "application/wasm",
+)
+
+_TRACKING_PARAMS = ("utm_", "fbclid", "gclid", "mc_cid", "mc_eid")
+
+_BROWSER_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Safari/537.36",
+    "Referer": "https://www.google.com",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
+    "Accept-Language": "en-gb, en",
+}
+
 
 class ScrapePreventedError(Exception):
     ...
 
 
+class UnsupportedContentError(Exception):
+    """
+    The url points to something we can't read, e.g. a video or a pdf that is too large.
+    """
+
+    def __init__(self, content_type: str, reason: str) -> None:
+        super().__init__(f"{content_type}: {reason}")
+        self.content_type = content_type
+        self.reason = reason
+
+
+def host_limit(url):
+    """
+    Returns a semaphore that bounds the number of in-flight requests to the host of `url`.
+    """
+    host = urlparse(url).netloc
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(
+                MAX_CONNECTIONS_PER_HOST
+            )
+        return _host_semaphores[host]
+
+
+def get_session() -> requests.Session:
+    """
+    The process wide session, which keeps a pool of alive connections to each host.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            adapter = HTTPAdapter(
+                pool_connections=32, pool_maxsize=MAX_CONNECTIONS_PER_HOST
+            )
+            _session = requests.Session()
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def request(method, url, timeout=DEFAULT_TIMEOUT, **kwargs) -> requests.Response:
+    """
+    Sends a request through the shared session. Connection errors and 429/5xx responses
+    are retried up to `MAX_RETRIES` times with jittered exponential backoff, honoring Retry-After.
+    """
+    with metrics.span("fetch", host=urlparse(url).netloc):
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                with host_limit(url):
+                    response = get_session().request(
+                        method, url, timeout=timeout, **kwargs
+                    )
+            except requests.exceptions.ConnectionError:
+                if attempt == MAX_RETRIES:
+                    raise
+                time.sleep(_backoff(attempt))
+                continue
+
+            if (
+                response.status_code not in _RETRY_STATUS_CODES
+                or attempt == MAX_RETRIES
+            ):
+                return response
+            delay = _retry_after(response)
+            if delay is None:
+                delay = _backoff(attempt)
+            response.close()
+            time.sleep(delay)
+
+
+def _backoff(attempt):
+    # "full jitter" - spreads out the retries of concurrent workers
+    return random.uniform(0, _RETRY_BACKOFF * 2**attempt)
+
+
+def _retry_after(response):
+    try:
+        return min(float(response.headers["Retry-After"]), 60.0)
+    except (KeyError, ValueError):
+        return None
+
+
 def get_json_from_url(url):
-    response = requests.get(url, timeout=5)
+    response = request("GET", url)
     response.raise_for_status()
     return response.json()
 
@@ -16,19 +167,142 @@ def get_text_from_url(url):
     return get_details_from_url(url)["text"]
 
 
+def canonical_url(url):
+    """
+    Normalizes `url` so that trivially different links to the same page compare equal
+    (case of the host, fragments, tracking query params, param order).
+    """
+    parts = urlparse(url.strip())
+    query = sorted(
+        (k, v)
+        for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.startswith(_TRACKING_PARAMS)
+    )
+    netloc = parts.netloc.lower()
+    if parts.scheme == "http" and netloc.endswith(":80"):
+        netloc = netloc[: -len(":80")]
+    elif parts.scheme == "https" and netloc.endswith(":443"):
+        netloc = netloc[: -len(":443")]
+    return urlunparse(
+        (
+            parts.scheme.lower(),
+            netloc,
+            parts.path or "/",
+            parts.params,
+            urlencode(query),
+            "",
+        )
+    )
+
+
 def get_details_from_url(url):
-    response = requests.get(
-        url,
-        timeout=10,
-        headers={
-            "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/118.0.0.0 Safari/537.36",
-            "Referer": "https://www.google.com",
-            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
-            "Accept-Language": "en-gb, en",
+    key = canonical_url(url)
+    headers = dict(_BROWSER_HEADERS)
+
+    cached = _page_cache.get(key)
+    if cached is not None:
+        details, stored_at = cached
+        if time.time() - stored_at < PAGE_CACHE_TTL:
+            return {"title": details["title"], "text": details["text"]}
+        if details["etag"] is not None:
+            headers["If-None-Match"] = details["etag"]
+        if details["last_modified"] is not None:
+            headers["If-Modified-Since"] = details["last_modified"]
+
+    with request("GET", url, headers=headers, stream=True) as response:
+        if cached is not None and response.status_code == 304:
+            _page_cache.touch(key)
+            return {"title": details["title"], "text": details["text"]}
+
+        response.raise_for_status()
+        with metrics.span("extract", host=urlparse(url).netloc):
+            details = _read_details(response)
+
+    _page_cache.set(
+        key,
+        {
+            "title": details["title"],
+            "text": details["text"],
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
         },
     )
-    response.raise_for_status()
-    soup = bs4.BeautifulSoup(response.content, "html.parser")
+    return details
+
+
+def _read_details(response: requests.Response):
+    """
+    Reads the body of a streamed `response` according to its content type: html is read
+    up to `MAX_PAGE_BYTES`, pdfs are converted to text, and media is rejected unread.
+    """
+    content_type = _content_type(response)
+    if content_type.startswith(_MEDIA_TYPES) or content_type.startswith(_BINARY_TYPES):
+        raise UnsupportedContentError(content_type, "not a readable document")
+
+    is_pdf = content_type == "application/pdf"
+    max_bytes = MAX_PDF_BYTES if is_pdf else MAX_PAGE_BYTES
+    if is_pdf and int(response.headers.get("Content-Length", 0)) > max_bytes:
+        raise UnsupportedContentError(content_type, f"larger than {max_bytes} bytes")
+
+    body = bytearray()
+    wide_encoding = None
+    for chunk in response.iter_content(_CHUNK_SIZE):
+        if len(body) == 0:
+            # servers often send pdfs & binaries as octet-stream, so also sniff the first bytes
+            # (NUL bytes are binary, unless the text is in UTF-16/32)
+            wide_encoding = _wide_encoding(response, chunk)
+            if chunk.startswith(b"%PDF-"):
+                is_pdf, max_bytes = True, MAX_PDF_BYTES
+            elif not is_pdf and wide_encoding is None and b"\x00" in chunk[:1024]:
+                raise UnsupportedContentError(content_type, "binary content")
+        body += chunk
+        if len(body) > max_bytes:
+            if is_pdf:
+                raise UnsupportedContentError(
+                    "application/pdf", f"larger than {max_bytes} bytes"
+                )
+            del body[max_bytes:]
+            break
+
+    if is_pdf:
+        details = parse_pdf.extract_text(bytes(body))
+        if len(details["text"]) == 0:
+            raise ScrapePreventedError()
+        return details
+    if wide_encoding is not None:
+        # the parsers only detect these from a BOM, not from the response's headers
+        return _extract_details(bytes(body).decode(wide_encoding, errors="replace"))
+    return _extract_details(bytes(body))
+
+
+def _content_type(response: requests.Response) -> str:
+    return response.headers.get("Content-Type", "").split(";")[0].strip().lower()
+
+
+def _wide_encoding(response: requests.Response, head: bytes):
+    """
+    The UTF-16/32 encoding of a text body starting with `head`, from its BOM or the
+    charset of its content type, or None if it isn't in either.
+    """
+    if head.startswith((codecs.BOM_UTF32_LE, codecs.BOM_UTF32_BE)):
+        return "utf-32"
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    charset = requests.utils.get_encoding_from_headers(response.headers) or ""
+    if charset.lower().startswith(("utf-16", "utf-32")):
+        return charset
+    return None
+
+
+def _extract_details(html):
+    details = extract.extract_details(html)
+    if details is not None and len(details["text"]) >= MIN_EXTRACTED_CHARS:
+        return details
+    return _extract_details_bs4(html)
+
+
+def _extract_details_bs4(html):
+    soup = bs4.BeautifulSoup(html, "html.parser")
     ele = soup.find(attrs={"role": "main"})
     if ele is None:
         ele = soup.find("main")
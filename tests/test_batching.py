@@ -0,0 +1,69 @@
+import threading
+
+import pytest
+
+from newsletter.batching import MicroBatcher
+
+
+def submit_all(batcher, items):
+    results = {}
+    errors = {}
+
+    def submit(item):
+        try:
+            results[item] = batcher.submit(item)
+        except Exception as err:
+            errors[item] = err
+
+    threads = [threading.Thread(target=submit, args=(item,)) for item in items]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    return results, errors
+
+
+def test_concurrent_items_are_sent_together():
+    batches = []
+
+    def send(items):
+        batches.append(list(items))
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(send, window=0.2, max_batch=16)
+    results, errors = submit_all(batcher, range(5))
+    assert errors == {}
+    assert results == {i: i * 2 for i in range(5)}
+    assert len(batches) == 1
+    assert sorted(batches[0]) == list(range(5))
+
+
+def test_batches_are_capped_at_max_batch():
+    batches = []
+
+    def send(items):
+        batches.append(list(items))
+        return items
+
+    batcher = MicroBatcher(send, window=0.2, max_batch=3)
+    results, _ = submit_all(batcher, range(7))
+    assert results == {i: i for i in range(7)}
+    assert all(len(batch) <= 3 for batch in batches)
+    assert sorted(item for batch in batches for item in batch) == list(range(7))
+
+
+def test_batch_errors_reach_every_item():
+    def send(items):
+        raise RuntimeError("server down")
+
+    batcher = MicroBatcher(send, window=0.05, max_batch=16)
+    results, errors = submit_all(batcher, range(3))
+    assert results == {}
+    assert sorted(errors) == [0, 1, 2]
+    assert all(isinstance(err, RuntimeError) for err in errors.values())
+
+
+def test_wrong_number_of_results_is_an_error():
+    batcher = MicroBatcher(lambda items: items[:-1], window=0.01, max_batch=1)
+    with pytest.raises(ValueError):
+        batcher.submit("a")
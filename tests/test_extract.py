@@ -0,0 +1,55 @@
+import pytest
+
+from newsletter import extract
+
+ARTICLE = """
+<p>The first paragraph of the article, long enough to count, with a comma or two.</p>
+<p>The second paragraph of the article, which says a bit more, and then some more.</p>
+<p>The third paragraph of the article, wrapping up what the first two started.</p>
+"""
+
+COMMENTS = """
+<div class="comments">
+  <div class="comment"><p>A reader's comment that is long enough to be scored, sadly.</p></div>
+  <div class="comment"><p>Another reader's comment, also long enough to be scored.</p></div>
+</div>
+"""
+
+
+def _page(body):
+    return f"<html><head><title>Title</title></head><body>{body}</body></html>".encode()
+
+
+@pytest.mark.parametrize(
+    "wrapper", ["container has-comments", "layout with-sidebar", "wrap social-enabled"]
+)
+def test_extract_details_keeps_negative_wrapper_of_article(wrapper):
+    details = extract.extract_details(
+        _page(f'<div class="{wrapper}"><article>{ARTICLE}</article>{COMMENTS}</div>')
+    )
+
+    assert details["title"] == "Title"
+    assert "The first paragraph" in details["text"]
+    assert "The third paragraph" in details["text"]
+    assert "reader's comment" not in details["text"]
+
+
+def test_extract_details_keeps_negative_wrapper_of_paragraphs():
+    details = extract.extract_details(
+        _page(f'<div class="container has-comments">{ARTICLE}</div>')
+    )
+
+    assert "The second paragraph" in details["text"]
+
+
+def test_extract_details_drops_boilerplate_inside_article():
+    details = extract.extract_details(
+        _page(
+            f'<div class="post">{ARTICLE}<div class="share-buttons">'
+            f"<p>Share this article with all of your friends, on every network.</p>"
+            f"</div></div>"
+        )
+    )
+
+    assert "The first paragraph" in details["text"]
+    assert "Share this article" not in details["text"]
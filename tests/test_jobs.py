@@ -0,0 +1,69 @@
+import threading
+import time
+
+from newsletter.jobs import JobQueue
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_duplicate_keys_are_dropped():
+    queue = JobQueue(num_workers=1, max_per_channel=1)
+    ran = []
+    assert queue.submit(lambda: ran.append(1), priority=0, channel="c", key="event")
+    assert not queue.submit(lambda: ran.append(2), priority=0, channel="c", key="event")
+    wait_until(lambda: len(ran) == 1)
+    time.sleep(0.05)
+    assert ran == [1]
+
+
+def test_higher_priority_jobs_run_first():
+    queue = JobQueue(num_workers=1, max_per_channel=10)
+    release = threading.Event()
+    ran = []
+    queue.submit(release.wait, priority=0, channel="a")
+    wait_until(lambda: len(queue._jobs) == 0)
+
+    queue.submit(lambda: ran.append("low 1"), priority=5, channel="a")
+    queue.submit(lambda: ran.append("high"), priority=1, channel="a")
+    queue.submit(lambda: ran.append("low 2"), priority=5, channel="a")
+    release.set()
+    wait_until(lambda: len(ran) == 3)
+    assert ran == ["high", "low 1", "low 2"]
+
+
+def test_jobs_per_channel_are_limited():
+    queue = JobQueue(num_workers=4, max_per_channel=1)
+    release = threading.Event()
+    started = []
+
+    def job(name):
+        started.append(name)
+        release.wait()
+
+    queue.submit(lambda: job("a1"), priority=0, channel="a")
+    queue.submit(lambda: job("a2"), priority=0, channel="a")
+    queue.submit(lambda: job("b1"), priority=0, channel="b")
+    wait_until(lambda: len(started) == 2)
+    time.sleep(0.05)
+    assert sorted(started) == ["a1", "b1"]
+
+    release.set()
+    wait_until(lambda: len(started) == 3)
+    assert started[-1] == "a2"
+
+
+def test_failing_jobs_do_not_stop_the_workers():
+    queue = JobQueue(num_workers=1, max_per_channel=1)
+    ran = []
+
+    def fail():
+        raise RuntimeError("boom")
+
+    queue.submit(fail, priority=0, channel="a")
+    queue.submit(lambda: ran.append(1), priority=0, channel="a")
+    wait_until(lambda: ran == [1])
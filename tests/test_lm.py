@@ -0,0 +1,173 @@
+import pytest
+from langchain.schema import AIMessage, ChatGeneration, LLMResult
+from openai import api_requestor
+from openai.error import InvalidRequestError
+
+from newsletter import lm
+
+
+@pytest.fixture(autouse=True)
+def no_tiktoken(monkeypatch):
+    # tiktoken downloads its encoding on first use, count ~4 characters per token instead
+    monkeypatch.setattr(lm, "tiktoken", None)
+
+
+def test_parse_batch_answers():
+    text = 'Sure! {"1": "Yes", "2": "no", "3": " NO "} hope that helps'
+    assert lm._parse_batch_answers(text, 3) == [True, False, False]
+
+
+def test_parse_batch_answers_missing_or_unclear():
+    assert lm._parse_batch_answers('{"1": "Yes", "3": "maybe"}', 3) == [
+        True,
+        None,
+        None,
+    ]
+
+
+@pytest.mark.parametrize("text", ["no json here", "{not json}", '{"1": "Yes"'])
+def test_parse_batch_answers_unparseable(text):
+    assert lm._parse_batch_answers(text, 2) == [None, None]
+
+
+def test_matches_filter_batch_falls_back_for_unparsed_answers(monkeypatch):
+    prompts = []
+
+    def fake_call_llm(prompt, **kwargs):
+        prompts.append(prompt)
+        return AIMessage(content='{"1": "No", "2": "???", "3": "Yes"}')
+
+    monkeypatch.setattr(lm, "_call_llm", fake_call_llm)
+    monkeypatch.setattr(lm, "matches_filter", lambda content, filter: content == "b")
+
+    assert lm.matches_filter_batch(["a", "b", "c"], "filter") == [False, True, True]
+    assert len(prompts) == 1
+
+
+def test_matches_filter_batch_splits_batches_over_budget(monkeypatch):
+    batches = []
+
+    def fake_call_llm(prompt, **kwargs):
+        num = prompt.count("[begin Article")
+        batches.append(num)
+        return AIMessage(
+            content="{" + ", ".join(f'"{i + 1}": "Yes"' for i in range(num)) + "}"
+        )
+
+    monkeypatch.setattr(lm, "_call_llm", fake_call_llm)
+    monkeypatch.setattr(lm, "BATCH_TOKEN_BUDGET", 300)
+
+    contents = ["x" * 200 for _ in range(4)]
+    assert lm.matches_filter_batch(contents, "filter") == [True] * 4
+    assert sum(batches) == 4
+    assert max(batches) < 4
+
+
+def test_extract_from_section_uses_the_given_model(monkeypatch):
+    calls = []
+
+    def fake_call_llm(prompt, **kwargs):
+        calls.append(kwargs)
+        return AIMessage(content='Here: {"summary": "it works", "relevant": true}')
+
+    monkeypatch.setattr(lm, "_call_llm", fake_call_llm)
+
+    assert lm.extract_from_section(
+        "Intro", "text", "does it work?", model="gpt-4", backend="openai"
+    ) == {"summary": "it works", "relevant": True}
+    assert calls[0]["model"] == "gpt-4"
+    assert calls[0]["backend"] == "openai"
+
+
+def test_call_llm_escalates_when_the_prompt_is_too_long(monkeypatch):
+    models = []
+    records = []
+
+    def fake_invoke_llm(backend, model, temperature, prompt, **kwargs):
+        models.append(model)
+        if model == "gpt-3.5-turbo-16k":
+            raise InvalidRequestError(
+                "too long", "messages", code="context_length_exceeded"
+            )
+        return AIMessage(content="ok"), {"prompt_tokens": 1, "completion_tokens": 1}
+
+    monkeypatch.setattr(lm, "_invoke_llm", fake_invoke_llm)
+    monkeypatch.setattr(
+        lm.usage, "record", lambda *args, **kwargs: records.append((args, kwargs))
+    )
+
+    assert lm._call_llm("short", temperature=0.5, backend="openai").content == "ok"
+    assert models == ["gpt-3.5-turbo-16k", "gpt-4-32k"]
+    assert records[-1][0][1] == "gpt-4-32k"
+    assert records[-1][1]["escalated"]
+
+
+def test_call_llm_does_not_retry_other_errors(monkeypatch):
+    def fake_invoke_llm(backend, model, temperature, prompt, **kwargs):
+        raise InvalidRequestError("bad", None, code="invalid_request")
+
+    monkeypatch.setattr(lm, "_invoke_llm", fake_invoke_llm)
+    monkeypatch.setattr(lm.usage, "record", lambda *args, **kwargs: None)
+
+    with pytest.raises(InvalidRequestError):
+        lm._call_llm("short", temperature=0.5, backend="openai")
+
+
+def test_split_by_tokens_on_line_boundaries():
+    text = "".join(f"line {i} " + "x" * 30 + "\n" for i in range(10))
+    chunks = lm._split_by_tokens(text, 20)
+    assert "".join(chunks) == text
+    assert len(chunks) == 5
+    assert all(chunk.endswith("\n") for chunk in chunks)
+    assert all(lm.count_tokens(chunk) <= 20 for chunk in chunks)
+
+
+def test_split_by_tokens_cuts_huge_lines():
+    text = "y" * 1000
+    chunks = lm._split_by_tokens(text, 50)
+    assert "".join(chunks) == text
+    assert len(chunks) == 5
+    assert all(lm.count_tokens(chunk) <= 50 for chunk in chunks)
+
+
+class FakeChatClient:
+    def __init__(self, replies):
+        self.replies = replies
+
+    def generate(self, messages, **kwargs):
+        reply = self.replies.pop(0)
+        return LLMResult(
+            generations=[[ChatGeneration(message=AIMessage(content=reply))]]
+        )
+
+
+def test_failed_openchat_batches_fall_back_to_single_prompts(monkeypatch):
+    class FailingBatcher:
+        def submit(self, prompt):
+            raise ConnectionError("no completions endpoint")
+
+    monkeypatch.setenv("OPENCHAT_BASE_URL", "http://openchat.test")
+    monkeypatch.setattr(lm, "OPENCHAT_BATCH_WINDOW", 0.01)
+    monkeypatch.setattr(lm, "_get_batcher", lambda model, temperature: FailingBatcher())
+    monkeypatch.setattr(
+        lm, "_get_client", lambda backend, model, temperature: FakeChatClient(["hi"])
+    )
+
+    message, _ = lm._invoke_llm("openchat", "openchat_3.5", 0.0, "hello")
+    assert message.content == "hi"
+
+
+def test_chat_clients_use_the_pooled_session_only_for_their_calls(monkeypatch):
+    seen = []
+
+    def fake_create(**kwargs):
+        seen.append(api_requestor._thread_context.session)
+        return "reply"
+
+    monkeypatch.setattr(lm.openai.ChatCompletion, "create", fake_create)
+    context = api_requestor._thread_context
+    monkeypatch.setattr(context, "session", "openai's own session", raising=False)
+
+    assert lm._PooledChatCompletion().create(model="m", messages=[]) == "reply"
+    assert seen == [lm._get_session()]
+    assert context.session == "openai's own session"
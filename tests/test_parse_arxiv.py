@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+
+import pytest
+
+from newsletter import parse_arxiv
+
+
+class FakeResponse:
+    def __init__(self, content):
+        self.content = content
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    downloads = []
+
+    def fake_request(method, url, **kwargs):
+        downloads.append(url)
+        return FakeResponse(b"%PDF-" + url.encode())
+
+    monkeypatch.setattr(parse_arxiv, "ARXIV_STORE_DIR", str(tmp_path))
+    monkeypatch.setattr(parse_arxiv, "request", fake_request)
+    return downloads
+
+
+def test_download_pdf_reuses_stored_pdf(store):
+    path = parse_arxiv.download_pdf("https://arxiv.org/abs/2310.06825v2")
+    assert parse_arxiv.download_pdf("https://arxiv.org/abs/2310.06825v2") == path
+    assert store == ["https://arxiv.org/pdf/2310.06825v2"]
+
+
+def test_latest_version_expires_even_when_used(store, monkeypatch):
+    url = "https://arxiv.org/abs/2310.06825"
+    path = parse_arxiv.download_pdf(url)
+    written = time.time() - parse_arxiv._LATEST_VERSION_TTL - 1
+    os.utime(path, (written, written))
+
+    # using the paper must not push back its re-download
+    parse_arxiv._touch(path)
+    assert os.path.getmtime(path) == pytest.approx(written)
+
+    parse_arxiv.download_pdf(url)
+    assert len(store) == 2
+
+
+def test_evict_removes_least_recently_used(store, monkeypatch):
+    paths = [
+        parse_arxiv.download_pdf(f"https://arxiv.org/abs/2310.0000{i}v1")
+        for i in range(3)
+    ]
+    for i, path in enumerate(paths):
+        os.utime(path, (1000 + i, os.path.getmtime(path)))
+    monkeypatch.setattr(
+        parse_arxiv, "ARXIV_STORE_MAX_BYTES", 2 * os.path.getsize(paths[0])
+    )
+
+    parse_arxiv._evict(keep="2310.00002v1")
+    assert [os.path.exists(p) for p in paths] == [False, True, True]
+
+
+def test_evict_skips_papers_in_use(store, monkeypatch):
+    paths = [
+        parse_arxiv.download_pdf(f"https://arxiv.org/abs/2310.1000{i}v1")
+        for i in range(2)
+    ]
+    os.utime(paths[0], (1000, os.path.getmtime(paths[0])))
+    monkeypatch.setattr(parse_arxiv, "ARXIV_STORE_MAX_BYTES", 0)
+
+    in_use = threading.Event()
+    done = threading.Event()
+
+    def read_paper():
+        with parse_arxiv._store_lock("2310.10000v1"):
+            in_use.set()
+            done.wait()
+
+    reader = threading.Thread(target=read_paper)
+    reader.start()
+    in_use.wait()
+    try:
+        parse_arxiv._evict(keep="2310.10001v1")
+        assert os.path.exists(paths[0])
+    finally:
+        done.set()
+        reader.join()
+
+    parse_arxiv._evict(keep="2310.10001v1")
+    assert not os.path.exists(paths[0])
+
+
+def test_searches_share_the_client_one_request_at_a_time(monkeypatch):
+    lock = threading.Lock()
+    active = 0
+    max_active = 0
+
+    class FakeClient:
+        def results(self, search):
+            nonlocal active, max_active
+            for page in range(3):
+                with lock:
+                    active += 1
+                    max_active = max(max_active, active)
+                time.sleep(0.01)  # "fetching" a page
+                with lock:
+                    active -= 1
+                yield from [f"{search}-{page}-{i}" for i in range(2)]
+
+    monkeypatch.setattr(parse_arxiv, "_get_client", lambda: FakeClient())
+
+    results = {}
+
+    def crawl(name):
+        results[name] = list(parse_arxiv._iter_results(name))
+
+    threads = [threading.Thread(target=crawl, args=(f"s{i}",)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max_active == 1
+    assert all(len(r) == 6 for r in results.values())
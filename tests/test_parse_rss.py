@@ -0,0 +1,25 @@
+from newsletter import parse_rss
+
+
+def test_get_feeds_defaults(monkeypatch):
+    monkeypatch.delenv("NEWSY_RSS_FEEDS", raising=False)
+    assert parse_rss.get_feeds() == parse_rss.DEFAULT_FEEDS
+
+
+def test_get_feeds_from_env(monkeypatch):
+    monkeypatch.setenv(
+        "NEWSY_RSS_FEEDS",
+        " A Blog | https://a.example/rss ;B|https://b.example/feed?x=1|2;",
+    )
+    assert parse_rss.get_feeds() == [
+        ("A Blog", "https://a.example/rss"),
+        ("B", "https://b.example/feed?x=1|2"),
+    ]
+
+
+def test_get_feeds_skips_malformed_entries(monkeypatch):
+    monkeypatch.setenv(
+        "NEWSY_RSS_FEEDS",
+        "https://no-name.example/rss;|https://x.example;Empty|;A|https://a.example",
+    )
+    assert parse_rss.get_feeds() == [("A", "https://a.example")]
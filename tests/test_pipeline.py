@@ -0,0 +1,74 @@
+import threading
+import time
+
+import pytest
+
+from newsletter import pipeline
+
+
+def test_map_ordered_keeps_input_order():
+    def slow_for_small(x):
+        time.sleep(0.01 * (5 - x))
+        return x * 10
+
+    results = [
+        (item, future.result())
+        for item, future in pipeline.map_ordered(slow_for_small, range(5))
+    ]
+    assert results == [(0, 0), (1, 10), (2, 20), (3, 30), (4, 40)]
+
+
+def test_map_ordered_propagates_errors_per_item():
+    def fail_on_two(x):
+        if x == 2:
+            raise ValueError("two")
+        return x
+
+    futures = list(pipeline.map_ordered(fail_on_two, range(4)))
+    assert [item for item, _ in futures] == [0, 1, 2, 3]
+    assert futures[1][1].result() == 1
+    with pytest.raises(ValueError, match="two"):
+        futures[2][1].result()
+    assert futures[3][1].result() == 3
+
+
+def test_map_ordered_limits_calls_in_flight():
+    lock = threading.Lock()
+    running = 0
+    max_running = 0
+
+    def work(x):
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.01)
+        with lock:
+            running -= 1
+        return x
+
+    for _, future in pipeline.map_ordered(work, range(20), max_in_flight=3):
+        future.result()
+    assert max_running <= 3
+
+
+def test_map_ordered_batched_yields_one_future_per_item():
+    calls = []
+
+    def double_all(batch):
+        calls.append(list(batch))
+        if 4 in batch:
+            raise RuntimeError("bad batch")
+        return [x * 2 for x in batch]
+
+    futures = list(pipeline.map_ordered_batched(double_all, range(5), batch_size=2))
+    assert sorted(calls) == [[0, 1], [2, 3], [4]]
+    assert [item for item, _ in futures] == [0, 1, 2, 3, 4]
+    assert [f.result() for _, f in futures[:4]] == [0, 2, 4, 6]
+    with pytest.raises(RuntimeError):
+        futures[4][1].result()
+
+
+def test_batched():
+    assert list(pipeline.batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(pipeline.batched([], 2)) == []
@@ -0,0 +1,41 @@
+from newsletter import rank
+
+
+def test_bm25_scores_prefers_matching_documents():
+    scores = rank.bm25_scores(
+        "diffusion models for images",
+        [
+            "A diffusion model that generates images from text.",
+            "Reinforcement learning for robot control.",
+            "Images of cats.",
+        ],
+    )
+    assert scores[0] > scores[2] > scores[1]
+    assert scores[1] == 0.0
+
+
+def test_bm25_scores_ignore_stopwords_and_plurals():
+    with_plural = rank.bm25_scores("the papers about models", ["a model", "the papers"])
+    assert with_plural[0] > 0
+    assert with_plural[1] == 0.0
+
+
+def test_bm25_scores_no_documents():
+    assert rank.bm25_scores("query", []) == []
+
+
+def test_prefilter_keeps_top_k_in_original_order():
+    items = ["a", "b", "c", "d"]
+    texts = ["nothing", "language model", "unrelated", "large language model"]
+    assert rank.prefilter(items, texts, "large language model", top_k=2) == ["b", "d"]
+
+
+def test_prefilter_min_score_adds_to_top_k():
+    items = ["a", "b", "c"]
+    texts = ["language model", "language", "nothing"]
+    kept = rank.prefilter(items, texts, "language model", top_k=1, min_score=0.01)
+    assert kept == ["a", "b"]
+
+
+def test_prefilter_without_limits_keeps_everything():
+    assert rank.prefilter(["a", "b"], ["x", "y"], "query") == ["a", "b"]
@@ -0,0 +1,115 @@
+import threading
+import time
+
+from slack_sdk.errors import SlackApiError
+
+from newsletter import slack
+
+
+class FakeMessage:
+    """
+    Stands in for an EditableMessage: records what the scheduler sends, and fails the
+    first `failures` updates with `error`.
+    """
+
+    def __init__(self, failures=0, error=ConnectionError("connection reset")):
+        self.thread = "1.0"
+        self.state = 0
+        self.sent = []
+        self.failures = failures
+        self.error = error
+        self.lock = threading.Lock()
+
+    def edit(self, scheduler):
+        with self.lock:
+            self.state += 1
+        scheduler.schedule(self)
+
+    def _render(self):
+        with self.lock:
+            return self.state, None
+
+    def _update(self, text, blocks):
+        if self.failures > 0:
+            self.failures -= 1
+            raise self.error
+        self.sent.append(text)
+
+
+def test_edits_are_coalesced():
+    scheduler = slack._UpdateScheduler(min_interval=0.2)
+    message = FakeMessage()
+    for _ in range(10):
+        message.edit(scheduler)
+    scheduler.flush(message, timeout=5)
+    # the first edit goes out right away, the rest wait out the interval as one update
+    assert message.sent[-1] == 10
+    assert len(message.sent) <= 2
+
+
+def test_updates_are_spaced_by_min_interval():
+    scheduler = slack._UpdateScheduler(min_interval=0.1)
+    message = FakeMessage()
+    start = time.monotonic()
+    message.edit(scheduler)
+    scheduler.flush(message, timeout=5)
+    message.edit(scheduler)
+    scheduler.flush(message, timeout=5)
+    assert message.sent == [1, 2]
+    assert time.monotonic() - start >= 0.1
+
+
+def test_failed_updates_are_retried():
+    scheduler = slack._UpdateScheduler(min_interval=0.01, max_attempts=3)
+    message = FakeMessage(failures=2)
+    message.edit(scheduler)
+    deadline = time.monotonic() + 5
+    while len(message.sent) == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert message.sent == [1]
+
+
+def test_rate_limits_honor_retry_after():
+    class Response:
+        status_code = 429
+        headers = {"Retry-After": "0.3"}
+
+    error = SlackApiError("ratelimited", Response())
+    scheduler = slack._UpdateScheduler(min_interval=0.01)
+    message = FakeMessage(failures=1, error=error)
+    start = time.monotonic()
+    message.edit(scheduler)
+    while len(message.sent) == 0 and time.monotonic() - start < 5:
+        time.sleep(0.01)
+    assert message.sent == [1]
+    assert time.monotonic() - start >= 0.3
+
+
+def test_errors_do_not_stop_other_messages():
+    scheduler = slack._UpdateScheduler(min_interval=0.01, max_attempts=1)
+    broken = FakeMessage(failures=1)
+    broken.edit(scheduler)
+    scheduler.flush(broken, timeout=2)
+    assert broken.sent == []
+
+    message = FakeMessage()
+    message.edit(scheduler)
+    start = time.monotonic()
+    scheduler.flush(message, timeout=2)
+    assert message.sent == [1]
+    assert time.monotonic() - start < 1
+
+
+def test_flush_times_out():
+    class StuckMessage(FakeMessage):
+        def _update(self, text, blocks):
+            release.wait()
+
+    release = threading.Event()
+    scheduler = slack._UpdateScheduler(min_interval=0.01)
+    message = StuckMessage()
+    message.edit(scheduler)
+    start = time.monotonic()
+    scheduler.flush(message, timeout=0.1)
+    assert time.monotonic() - start < 1
+    release.set()
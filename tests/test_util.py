@@ -0,0 +1,71 @@
+import pytest
+import requests
+
+from newsletter import util
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        ("https://Example.COM/a?b=2&a=1", "https://example.com/a?a=1&b=2"),
+        ("https://example.com/a#section", "https://example.com/a"),
+        ("https://example.com:443/a", "https://example.com/a"),
+        ("http://example.com:80", "http://example.com/"),
+        (
+            "https://example.com/a?utm_source=x&id=3&fbclid=y",
+            "https://example.com/a?id=3",
+        ),
+        ("  https://example.com/a  ", "https://example.com/a"),
+    ],
+)
+def test_canonical_url(url, expected):
+    assert util.canonical_url(url) == expected
+
+
+def test_canonical_url_keeps_other_ports_and_paths():
+    assert (
+        util.canonical_url("http://example.com:8080/A/b")
+        == "http://example.com:8080/A/b"
+    )
+
+
+class FakeResponse:
+    def __init__(self, body: bytes, content_type: str):
+        self.headers = requests.structures.CaseInsensitiveDict(
+            {"Content-Type": content_type}
+        )
+        self.body = body
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i : i + chunk_size]
+
+
+PAGE = (
+    "<html><head><title>Ünïcode</title></head><body><article>"
+    + "<p>A paragraph of the article, long enough to be scored, with a comma.</p>" * 5
+    + "</article></body></html>"
+)
+
+
+@pytest.mark.parametrize(
+    "body, content_type",
+    [
+        (PAGE.encode("utf-16"), "text/html"),
+        (PAGE.encode("utf-16-le"), "text/html; charset=UTF-16LE"),
+        (PAGE.encode("utf-16-be"), "text/html; charset=utf-16be"),
+        (PAGE.encode("utf-32"), ""),
+    ],
+)
+def test_read_details_decodes_utf16_pages(body, content_type):
+    details = util._read_details(FakeResponse(body, content_type))
+
+    assert details["title"] == "Ünïcode"
+    assert "A paragraph of the article" in details["text"]
+
+
+def test_read_details_rejects_binary_content():
+    with pytest.raises(util.UnsupportedContentError):
+        util._read_details(
+            FakeResponse(b"\x7fELF\x02\x01\x01\x00" + b"\x00" * 100, "text/plain")
+        )